@@ -0,0 +1,294 @@
+"""Disk-backed store for uploads and generated downloads.
+
+Streamlit keeps every uploaded file and every st.download_button / st.image
+payload as bytes in the server process, per session. With a few people
+building big ZIPs at once that is what pushes the container into swap.
+
+install() swaps the dicts behind Streamlit's media and upload managers for
+ones that spill large payloads to ARTIFACT_DIR and read them back only when
+they're served. Files are evicted after ARTIFACT_TTL_MIN minutes without
+access, and least-recently-used first once ARTIFACT_MAX_MB is exceeded.
+A session's uploads are deleted when Streamlit drops the session. Each
+server process keeps its files in ARTIFACT_DIR/<pid>; the first install()
+in a process deletes what earlier processes left behind (ARTIFACT_DIR
+survives a container restart).
+This reaches into Streamlit internals (pinned in requirements.txt); if they
+ever change shape, install() logs a warning and Streamlit keeps its default
+in-memory behaviour.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from collections.abc import MutableMapping
+
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "janebi-artifacts"))
+MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024
+TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_MIN", "60")) * 60
+SPILL_MIN_BYTES = 256 * 1024  # small previews/icons stay in memory
+
+_LOGGER = logging.getLogger(__name__)
+
+class ArtifactStore:
+    """Files on disk with a byte quota, TTL and LRU eviction. Thread-safe."""
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=MAX_BYTES, ttl_seconds=TTL_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size = 0
+        self.evicted = 0
+        self._entries = OrderedDict()  # name -> [size, last_access], oldest access first
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def put(self, data):
+        """Writes bytes to disk and returns the artifact name."""
+        name = uuid.uuid4().hex
+        with open(self._path(name), "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._entries[name] = [len(data), time.time()]
+            self.size += len(data)
+            self._evict()
+        return name
+
+    def _touch(self, name):
+        """Marks an artifact as just used, and evicts what expired meanwhile."""
+        with self._lock:
+            self._evict()
+            entry = self._entries[name]
+            entry[1] = time.time()
+            self._entries.move_to_end(name)
+
+    def open(self, name):
+        """Opens the artifact for reading. Raises KeyError once it has been evicted."""
+        self._touch(name)
+        try:
+            return open(self._path(name), "rb")
+        except FileNotFoundError:
+            raise KeyError(name) from None  # evicted in between
+
+    def read(self, name):
+        """Returns the artifact's bytes. Raises KeyError once it has been evicted."""
+        with self.open(name) as f:
+            return f.read()
+
+    def size_of(self, name):
+        with self._lock:
+            return self._entries[name][0]
+
+    def remove(self, name):
+        with self._lock:
+            self._remove(name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        with self._lock:
+            self._evict()
+            return name in self._entries
+
+    def clear_stale(self):
+        """Deletes files in the store's dir that it doesn't know about (left by an earlier process with our pid)."""
+        with self._lock:
+            known = set(self._entries)
+        for name in os.listdir(self.root):
+            if name not in known:
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(name))
+
+    def _remove(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self.size -= entry[0]
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(name))
+
+    def _evict(self):
+        now = time.time()
+        for name, (_, last_access) in list(self._entries.items()):
+            if now - last_access <= self.ttl_seconds:
+                break  # ordered by access time, the rest are fresher
+            self._remove(name)
+            self.evicted += 1
+        while self.size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evicted += 1
+
+artifacts = ArtifactStore(os.path.join(ARTIFACT_DIR, str(os.getpid())))
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_leftovers():
+    """Removes the artifact dirs of server processes that are gone, and our own dir's untracked files."""
+    for entry in os.listdir(ARTIFACT_DIR):
+        path = os.path.join(ARTIFACT_DIR, entry)
+        if path == artifacts.root:
+            artifacts.clear_stale()
+        elif entry.isdigit() and not _alive(int(entry)):
+            shutil.rmtree(path, ignore_errors=True)
+
+class SpilledRecord:
+    """Stands in for a Streamlit MemoryFile / UploadedFileRec whose payload is on disk."""
+
+    def __init__(self, record, field, name, store):
+        self._meta = record._replace(**{field: b""})
+        self._field = field
+        self._name = name
+        self._store = store
+
+    def __getattr__(self, attr):
+        if attr == self._field:
+            return self._store.read(self._name)
+        if attr == "content_size":
+            return self._store.size_of(self._name)
+        return getattr(self._meta, attr)
+
+    def view(self):
+        return SpilledView(self)
+
+    def release(self):
+        self._store.remove(self._name)
+
+class SpilledView:
+    """What a lookup returns: reads the payload from disk at most once.
+
+    Streamlit reads the field twice per use (UploadedFile takes `.data` for
+    its buffer and again for its size, range requests take `.content`
+    twice). The bytes live as long as the view, i.e. that one use; the
+    stored record never holds them.
+    """
+
+    def __init__(self, record):
+        self._record = record
+        self._payload = None
+
+    def __getattr__(self, attr):
+        if attr == self._record._field:
+            if self._payload is None:
+                self._payload = self._record._store.read(self._record._name)
+            return self._payload
+        return getattr(self._record, attr)
+
+class SpillingDict(MutableMapping):
+    """dict replacement that moves records with a large payload field to disk."""
+
+    def __init__(self, initial, field, store):
+        self._data = {}
+        self._field = field
+        self._store = store
+        self.update(initial)
+
+    def __setitem__(self, key, record):
+        payload = getattr(record, self._field, None)
+        if isinstance(payload, bytes) and len(payload) >= SPILL_MIN_BYTES:
+            record = SpilledRecord(record, self._field, self._store.put(payload), self._store)
+        self._release(key)
+        self._data[key] = record
+
+    def __getitem__(self, key):
+        record = self._data[key]
+        if isinstance(record, SpilledRecord) and record._name not in self._store:
+            del self._data[key]  # evicted: behave as if Streamlit had deleted it
+            raise KeyError(key)
+        return record.view() if isinstance(record, SpilledRecord) else record
+
+    def __delitem__(self, key):
+        self._release(key)
+        del self._data[key]
+
+    def _release(self, key):
+        record = self._data.get(key)
+        if isinstance(record, SpilledRecord):
+            record.release()
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        # MutableMapping.clear() would stop at the first evicted record (its KeyError)
+        for key in list(self._data):
+            self._release(key)
+        self._data.clear()
+
+    def copy(self):
+        return {key: record.view() if isinstance(record, SpilledRecord) else record for key, record in self._data.items()}
+
+class SessionUploads(defaultdict):
+    """Streamlit's per-session upload dict; releases a session's files when it's dropped."""
+
+    def pop(self, key, *default):
+        files = super().pop(key, *default)
+        if isinstance(files, SpillingDict):
+            files.clear()
+        return files
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+_install_lock = threading.Lock()
+_cleared = False
+
+def install():
+    """Routes Streamlit's media and upload storage through the artifact store.
+
+    Cheap to call on every rerun: it only does something the first time it
+    sees a given runtime.
+    """
+    global _cleared
+    from streamlit import runtime
+    if not runtime.exists():
+        return False
+    rt = runtime.get_instance()
+    with _install_lock:
+        if not _cleared:
+            clear_leftovers()
+            _cleared = True
+        try:
+            media = rt.media_file_mgr._storage
+            if isinstance(media._files_by_id, SpillingDict):
+                return True
+            media._files_by_id = SpillingDict(media._files_by_id, "content", artifacts)
+
+            uploads = getattr(rt.uploaded_file_mgr, "file_storage", None)
+            if isinstance(uploads, defaultdict):
+                rt.uploaded_file_mgr.file_storage = SessionUploads(
+                    lambda: SpillingDict({}, "data", artifacts),
+                    {session_id: SpillingDict(files, "data", artifacts) for session_id, files in uploads.items()},
+                )
+        except AttributeError as e:
+            _LOGGER.warning("Artifact store not installed, Streamlit internals changed: %s", e)
+            return False
+        return True
+
+@contextlib.contextmanager
+def scratch_path(suffix=""):
+    """A temp file path in the artifact dir for building big outputs on disk; removed on exit."""
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=artifacts.root)
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
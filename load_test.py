@@ -0,0 +1,419 @@
+"""Concurrent-session load test for the dashboard.
+
+Drives خانه.py and every page headlessly with Streamlit's AppTest, N
+sessions at a time, each doing a realistic workload (SMS merge, number
+filter, discount match, bulk QR, a scrape against a local stand-in shop),
+and reports latency percentiles, throughput and memory per session count.
+
+Sessions run as threads in this one process, like browser sessions in a
+real server: they share the worker pool, the artifact store and the
+caches. AppTest normally gives every run its own throwaway runtime and the
+same session id, so _patch_apptest() makes all runs share one runtime and
+gives each simulated session its own id. AppTest can't upload files, so
+uploads are injected straight into the script runner's upload manager.
+Memory is the peak RSS of this process plus its worker processes (the
+stand-in shop runs here too, but it's small).
+
+    python load_test.py --sessions 1 2 4 8 --iterations 3 --rows 5000
+    python load_test.py --workloads sms filter --sessions 4 --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+HOME = os.path.join(ROOT, "خانه.py")
+PAGES = {
+    "sms": os.path.join(ROOT, "pages", "آماده سازی فایل SMS.py"),
+    "scrape": os.path.join(ROOT, "pages", "اسکریپر عکس محصول.py"),
+    "discount": os.path.join(ROOT, "pages", "تحلیل کد تخفیف.py"),
+    "qr": os.path.join(ROOT, "pages", "ساخت کد QR.py"),
+    "filter": os.path.join(ROOT, "pages", "فیلتر شماره.py"),
+}
+TIMEOUT = 600
+
+# --- LOCAL STAND-IN SHOP ---
+class ShopHandler(BaseHTTPRequestHandler):
+    """Serves janebi-like product pages (<img id="main_product_image">) and their images."""
+
+    image = None
+
+    def do_GET(self):
+        if self.path.startswith("/product/"):
+            n = self.path.rsplit("/", 1)[-1]
+            body = (f'<html><head><meta property="og:title" content="Product {n}"></head><body><h1>Product {n}</h1>'
+                    f'<span itemprop="sku">SKU-{n}</span><span itemprop="price" content="{int(n) * 1000}">{n},000 تومان</span>'
+                    f'<link itemprop="availability" href="https://schema.org/InStock">'
+                    f'<img id="main_product_image" src="http://{self.headers["Host"]}/img/{n}.jpg" alt="Product {n}"></body></html>').encode()
+            ctype = "text/html; charset=utf-8"
+        elif self.path.startswith("/img/"):
+            body, ctype = self.image, "image/jpeg"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_shop():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (1200, 900), (180, 40, 40)).save(buf, "JPEG")
+    ShopHandler.image = buf.getvalue()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ShopHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- APPTEST WITH UPLOADS ---
+_UPLOADS = {}  # file_id -> UploadedFileRec, shared by every runner in this process
+_SESSION = threading.local()  # .id and .uploads of the simulated session on this thread
+
+def _patch_apptest():
+    """Makes AppTest runs behave like sessions of one server. Call once, before any run."""
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.memory_uploaded_file_manager import MemoryUploadedFileManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    class InjectedUploads(MemoryUploadedFileManager):
+        def get_files(self, session_id, file_ids):
+            return [_UPLOADS[f] for f in file_ids if f in _UPLOADS]
+
+    class SessionScriptRunner(local_script_runner.LocalScriptRunner):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._session_id = getattr(_SESSION, "id", self._session_id)
+
+    class RuntimeStub:
+        _instance = None  # AppTest sets and clears this around every run; keep that away from the real one
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # One compiled copy of each page, like the server (parallel ast.parse also trips a 3.11 bug)
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = app_test.ScriptCache = lambda: script_cache
+    local_script_runner.MemoryUploadedFileManager = InjectedUploads
+    app_test.LocalScriptRunner = SessionScriptRunner
+    app_test.Runtime = RuntimeStub
+    # Runs overlap, so apply the config AppTest patches in per run once, for good
+    config.get_option = build_mock_config_get_option({"global.appTest": True})
+    app_test.patch_config_options = lambda options: contextlib.nullcontext()
+
+def _end_session():
+    """What the server does when a browser session goes away: drop its media and uploads."""
+    from streamlit import runtime
+    media = runtime.get_instance().media_file_mgr
+    media.clear_session_refs(_SESSION.id)
+    media.remove_orphaned_files()
+    for file_id in _SESSION.uploads:
+        _UPLOADS.pop(file_id, None)
+    _SESSION.uploads = []
+
+def make_app(path):
+    from streamlit.proto.Common_pb2 import FileUploaderState
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+    from streamlit.runtime.uploaded_file_manager import UploadedFileRec
+    from streamlit.testing.v1 import AppTest
+
+    class UploadAppTest(AppTest):
+        """AppTest plus upload(): file_uploader widgets keep their files on every rerun."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._upload_states = {}
+
+        def upload(self, label, files):
+            widget = next(w for w in self.get("file_uploader") if w.proto.label == label)
+            state = FileUploaderState()
+            for name, data in files:
+                file_id = uuid.uuid4().hex
+                _UPLOADS[file_id] = UploadedFileRec(file_id, name, "application/octet-stream", data)
+                if hasattr(_SESSION, "uploads"):
+                    _SESSION.uploads.append(file_id)
+                info = state.uploaded_file_info.add()
+                info.file_id, info.name, info.size = file_id, name, len(data)
+            self._upload_states[widget.proto.id] = state
+            return self.run()
+
+        def _run(self, widget_state=None, timeout=None):
+            if self._upload_states:
+                if widget_state is None:
+                    from streamlit.proto.WidgetStates_pb2 import WidgetStates
+                    widget_state = WidgetStates()
+                for widget_id, state in self._upload_states.items():
+                    widget_state.widgets.append(WidgetState(id=widget_id, file_uploader_state_value=state))
+            return super()._run(widget_state, timeout)
+
+    return UploadAppTest(path, default_timeout=TIMEOUT)
+
+def csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8")
+
+def xlsx_bytes(df, header_rows=0):
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, startrow=header_rows)
+    return buf.getvalue()
+
+def phones(n, rng):
+    formats = ["0912{:07d}", "+98 912 {:07d}", "98912{:07d}", "۰۹۱۲{:07d}"]
+    out = []
+    for _ in range(n):
+        num = f"{rng.randrange(10**7):07d}"
+        fmt = rng.choice(formats)
+        out.append(fmt.format(int(num)) if "۰" not in fmt else "۰۹۱۲" + num.translate(str.maketrans("0123456789", "۰۱۲۳۴۵۶۷۸۹")))
+    return out
+
+def radio(at, label):
+    return next(r for r in at.radio if r.label == label)
+
+def button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return at
+
+def expect_download(at):
+    """A workload only counts if it got as far as offering its result. Returns the first download's bytes."""
+    from streamlit import runtime
+    check(at)
+    if not at.get("download_button"):
+        errors = [e.value for e in at.error]
+        raise RuntimeError(errors[0] if errors else "no download offered")
+    filename = at.get("download_button")[0].proto.url.rsplit("/", 1)[-1]
+    return runtime.get_instance().media_file_mgr._storage.get_file(filename).content
+
+# --- WORKLOADS ---
+def wl_home(rows, rng, shop):
+    check(make_app(HOME).run())
+
+def wl_sms(rows, rng, shop):
+    at = check(make_app(PAGES["sms"]).run())
+    files = [(f"list_{i}.csv", csv_bytes(pd.DataFrame({"mobile": phones(rows, rng), "name": "x"}))) for i in range(3)]
+    at = check(at.upload("Upload Excel/CSV Files (You can select multiple)", files))
+    expect_download(button(at, "🚀 Merge & Clean All").click().run())
+
+def wl_filter(rows, rng, shop):
+    at = check(make_app(PAGES["filter"]).run())
+    main = pd.DataFrame({"mobile": phones(rows, rng), "email": [f"u{i}@x.com" for i in range(rows)]})
+    at = check(at.upload("Upload Main File", [("main.csv", csv_bytes(main))]))
+    blocks = [("optout_sms.csv", csv_bytes(pd.DataFrame({"phone": phones(rows // 4, rng)}))),
+              ("optout_mail.csv", csv_bytes(pd.DataFrame({"email": [f"u{i}@x.com" for i in range(0, rows, 7)]})))]
+    at = check(at.upload("Upload one or more files", blocks))
+    expect_download(button(at, "🚀 Run Multi-File Cleaning").click().run())
+
+def wl_discount(rows, rng, shop):
+    at = check(make_app(PAGES["discount"]).run())
+    codes = [f"ali-{i}" for i in range(50)] + [f"summer{i}" for i in range(50)]
+    orders = pd.DataFrame({
+        "order id": range(rows),
+        "code": [rng.choice(codes + ["", "other"]) for _ in range(rows)],
+        "price": [f"{rng.randrange(1, 500) * 1000:,}" for _ in range(rows)],
+        "discount": [f"{rng.randrange(0, 50) * 1000:,} تومان" for _ in range(rows)],
+        "date": pd.date_range("2025-01-01", periods=rows, freq="37min").astype(str),
+    })
+    at = check(at.upload("Upload the main file (Orders)", [("orders.csv", csv_bytes(orders))]))
+    code_list = pd.DataFrame({0: ["ALI-*"] + [f"SUMMER{i}" for i in range(0, 50, 2)]})
+    at = check(at.upload("Upload the list of codes to find (CSV/Excel)", [("codes.csv", code_list.to_csv(index=False, header=False).encode())]))
+    expect_download(button(at, "🚀 Match & Analyze").click().run())
+
+def wl_qr(rows, rng, shop):
+    at = check(make_app(PAGES["qr"]).run())
+    at = check(radio(at, "Choose Input Method:").set_value("📂 Upload File").run())
+    links = pd.DataFrame({"link": [f"janebi.com/product/p{rng.randrange(rows)}" for _ in range(max(1, rows // 50))]})
+    at = check(at.upload("Upload Excel/CSV", [("links.csv", csv_bytes(links))]))
+    expect_download(button(at, "🚀 Generate All QR Codes").click().run())
+
+def wl_scrape(rows, rng, shop):
+    at = check(make_app(PAGES["scrape"]).run())
+    at = check(radio(at, "Choose Input Method:").set_value("📂 Upload File").run())
+    urls = pd.DataFrame({"لینک محصول": [f"{shop}/product/{i}" for i in range(max(1, rows // 200))]})
+    at = check(at.upload("Upload Excel", [("products.xlsx", xlsx_bytes(urls, header_rows=1))]))
+    data = expect_download(next(b for b in at.button if b.label.startswith("🚀 Start Fast Scraping")).click().run())
+    # A ZIP of failures is still a ZIP: every URL has to come back with its image and data
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        if "errors.txt" in zf.namelist():
+            raise RuntimeError(f"scrape errors: {zf.read('errors.txt').decode().splitlines()[0]}")
+        images = sum(name.startswith("images/") for name in zf.namelist())
+        products = pd.read_csv(zf.open("products.csv"), dtype=str)
+    if images != len(urls) or len(products) != len(urls) or products["title"].isna().any():
+        raise RuntimeError(f"scraped {images} images, {len(products)} product rows for {len(urls)} URLs")
+
+WORKLOADS = {"home": wl_home, "sms": wl_sms, "filter": wl_filter, "discount": wl_discount, "qr": wl_qr, "scrape": wl_scrape}
+
+# --- RUNNER ---
+def run_session(session, workloads, iterations, rows, shop, barrier):
+    """One simulated session: runs each workload `iterations` times, in random order."""
+    _SESSION.id, _SESSION.uploads = f"load-test-{session}", []
+    rng = random.Random(session)
+    plan = [w for w in workloads for _ in range(iterations)]
+    rng.shuffle(plan)
+
+    barrier.wait()  # start all sessions together
+    results = []
+    for name in plan:
+        start = time.perf_counter()
+        error = None
+        try:
+            WORKLOADS[name](rows, rng, shop)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append((name, time.perf_counter() - start, error))
+        _end_session()
+    return results
+
+def server_rss():
+    """RSS in bytes of this process and every process under it (the worker pool's)."""
+    total, pids = 0, [os.getpid()]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pids += [int(child) for child in f.read().split()]
+        except (OSError, StopIteration):
+            continue  # exited meanwhile
+    return total
+
+def cgroup_memory():
+    """Container memory in bytes (cgroup v2, then v1), or None outside a container."""
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            continue
+    return None
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def run_round(n_sessions, workloads, iterations, rows, shop):
+    barrier = threading.Barrier(n_sessions)
+    outputs = [None] * n_sessions
+
+    peak_rss = [server_rss()]
+    peak_container = [cgroup_memory() or 0]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.2):
+            peak_rss[0] = max(peak_rss[0], server_rss())
+            peak_container[0] = max(peak_container[0], cgroup_memory() or 0)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    def session(i):
+        outputs[i] = run_session(i, workloads, iterations, rows, shop, barrier)
+    threads = [threading.Thread(target=session, args=(i,), name=f"session-{i}") for i in range(n_sessions)]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+
+    latencies = {}
+    errors = []
+    for results in outputs:
+        for name, seconds, error in results:
+            if error:
+                errors.append(f"{name}: {error}")
+            else:
+                latencies.setdefault(name, []).append(seconds)
+    all_lat = [s for v in latencies.values() for s in v]
+    return {
+        "sessions": n_sessions,
+        "wall_s": wall,
+        "completed": len(all_lat),
+        "errors": errors,
+        "throughput_per_min": len(all_lat) / wall * 60,
+        "p50_s": percentile(all_lat, 50),
+        "p95_s": percentile(all_lat, 95),
+        "p99_s": percentile(all_lat, 99),
+        "per_workload": {name: {"n": len(v), "p50_s": percentile(v, 50), "p95_s": percentile(v, 95)}
+                         for name, v in sorted(latencies.items())},
+        "peak_rss_mb": peak_rss[0] / 1024 / 1024,
+        "peak_container_mb": peak_container[0] / 1024 / 1024 if peak_container[0] else None,
+    }
+
+def print_report(rounds):
+    print()
+    print(f"{'sessions':>8} {'done':>5} {'err':>4} {'thru/min':>9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'RSS MB':>8} {'cgroup MB':>9}")
+    for r in rounds:
+        cgroup = f"{r['peak_container_mb']:.0f}" if r["peak_container_mb"] else "-"
+        print(f"{r['sessions']:>8} {r['completed']:>5} {len(r['errors']):>4} {r['throughput_per_min']:>9.1f} "
+              f"{r['p50_s']:>7.2f} {r['p95_s']:>7.2f} {r['p99_s']:>7.2f} {r['peak_rss_mb']:>8.0f} {cgroup:>9}")
+    print()
+    for r in rounds:
+        parts = ", ".join(f"{k} p50={v['p50_s']:.2f}s p95={v['p95_s']:.2f}s" for k, v in r["per_workload"].items())
+        print(f"[{r['sessions']} sessions] {parts}")
+        for e in r["errors"][:5]:
+            print(f"    ⚠️ {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent session counts to test")
+    parser.add_argument("--iterations", type=int, default=2, help="runs of each workload per session")
+    parser.add_argument("--rows", type=int, default=5000, help="rows in generated input files")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)  # what `streamlit run` does for the pages' imports
+    logging.disable(logging.WARNING)  # bare-mode and deprecation warnings on every call
+    _patch_apptest()
+    server, shop = start_shop()
+    rounds = []
+    try:
+        for n in args.sessions:
+            print(f"▶ {n} session(s)...", flush=True)
+            rounds.append(run_round(n, args.workloads, args.iterations, args.rows, shop))
+    finally:
+        server.shutdown()
+
+    print_report(rounds)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rounds, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Local Parquet store for order history exports (used by the discount analyzer).
+
+Layout: <root>/month=YYYY-MM/part.parquet (Hive-style partitions), plus
+<root>/_store.json with the column roles chosen on first ingest. Every
+column is kept as a string, same as the page's read_excel(dtype=str).
+A normalized copy of the code column (CODE_KEY) is stored too, and each
+partition is sorted by it, so code filters can skip whole row groups.
+
+Ingests hold an exclusive lock on <root>/.lock (flock, so it also works
+across server processes) and swap files in with os.replace, so readers
+never see a half-written partition.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DEFAULT_ROOT = os.environ.get("ORDER_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "order_store"))
+CODE_KEY = "__code"
+MONTH_KEY = "month"
+ROW_GROUP_SIZE = 50_000
+NO_MONTH = "unknown"
+
+DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '0123456789' * 2)
+
+def normalize_codes(series):
+    """Same normalization the matcher applies: str, stripped, lowercased."""
+    return series.astype(str).str.strip().str.lower()
+
+def month_keys(series):
+    """'YYYY-MM' partition key per row (Jalali text dates keep their own year)."""
+    dates = pd.to_datetime(series, errors='coerce', format='mixed')
+    if dates.notna().sum() >= series.notna().sum() / 2 and dates.dt.year.median() > 1700:
+        keys = dates.dt.strftime('%Y-%m')
+    else:
+        # Jalali text: zero-pad the month, so '1403/5/3' and '1403/05/03' share a partition
+        parts = series.astype(str).str.strip().str.translate(DIGITS).str.extract(r'^(\d{4})[/-](0?[1-9]|1[0-2])(?!\d)')
+        keys = (parts[0] + '-' + parts[1].str.zfill(2)).where(series.notna())
+    return keys.fillna(NO_MONTH)
+
+class OrderStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self.meta_path = os.path.join(root, "_store.json")
+
+    # --- metadata ---
+    @property
+    def meta(self):
+        if not os.path.exists(self.meta_path):
+            return {}
+        with open(self.meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".", suffix=".tmp")
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _partition_path(self, month):
+        return os.path.join(self.root, f"{MONTH_KEY}={month}", "part.parquet")
+
+    def months(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            d.split("=", 1)[1] for d in os.listdir(self.root)
+            if d.startswith(f"{MONTH_KEY}=") and os.path.exists(os.path.join(self.root, d, "part.parquet"))
+        )
+
+    def columns(self):
+        """Original export columns (without the store's helper columns)."""
+        return self.meta.get("columns", [])
+
+    def row_count(self, months=None):
+        """Counts rows from Parquet footers only, no data is read."""
+        months = self.months() if months is None else months
+        return sum(pq.ParquetFile(self._partition_path(m)).metadata.num_rows for m in months)
+
+    # --- writing ---
+    def _write_partition(self, path, part):
+        if part.empty:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+            return
+        table = pa.Table.from_pandas(part, schema=pa.schema([(c, pa.string()) for c in part.columns]), preserve_index=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")  # dot-files are ignored by readers
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def ingest(self, df, key_cols, date_col, code_col):
+        """Appends an export, replacing stored rows with the same key.
+
+        Keys are checked against every month, not just the one the row
+        lands in, so an order whose date changed between exports moves
+        instead of being stored twice. Only the key columns of untouched
+        months are read.
+        Returns (rows ingested, duplicate rows replaced or dropped).
+        """
+        with self._locked():
+            meta = self.meta
+            if meta and (meta["date_col"], meta["code_col"]) != (date_col, code_col):
+                raise ValueError(f"Store uses date column '{meta['date_col']}' and code column '{meta['code_col']}'.")
+
+            df = df.astype(str).where(df.notna(), None)
+            before = len(df)
+            df = df.drop_duplicates(subset=key_cols, keep="last")  # later rows of the same export win
+            dupes = before - len(df)
+            df[CODE_KEY] = normalize_codes(df[code_col])
+            new_keys = pd.MultiIndex.from_frame(df[key_cols])
+            incoming = dict(tuple(df.groupby(month_keys(df[date_col]), sort=False)))
+
+            columns = list(dict.fromkeys(meta.get("columns", []) + [c for c in df.columns if c != CODE_KEY]))
+            for month in sorted(set(self.months()) | set(incoming)):
+                path = self._partition_path(month)
+                part = incoming.get(month)
+                if os.path.exists(path):
+                    stored = pq.read_schema(path).names
+                    old_keys = pq.read_table(path, columns=[c for c in key_cols if c in stored]).to_pandas()
+                    replaced = pd.MultiIndex.from_frame(old_keys.reindex(columns=key_cols)).isin(new_keys)
+                    if part is None and not replaced.any():
+                        continue
+                    # Newer export wins for the same key
+                    old = pq.read_table(path).to_pandas()[~replaced]
+                    dupes += int(replaced.sum())
+                    part = old if part is None else pd.concat([old, part], ignore_index=True)
+                self._write_partition(path, part.reindex(columns=columns + [CODE_KEY]).sort_values(CODE_KEY, kind="stable"))
+
+            self._write_meta({"date_col": date_col, "code_col": code_col, "key_cols": key_cols, "columns": columns})
+        return len(df), dupes
+
+    # --- reading ---
+    def query(self, codes=None, month_from=None, month_to=None, columns=None):
+        """Loads matching rows, pushing the code and month filters into the Parquet scan.
+
+        Month bounds prune partitions; the code filter is checked against
+        row-group statistics first, so only the needed row groups and
+        columns are decoded.
+        """
+        months = self.months()
+        if not months:
+            return pd.DataFrame(columns=list(self.columns() if columns is None else columns) + [CODE_KEY])
+
+        partitioning = ds.partitioning(pa.schema([(MONTH_KEY, pa.string())]), flavor="hive")
+        # Explicit schema: otherwise it's inferred from one file, and a column added
+        # by a later ingest isn't found. Older partitions read it as null.
+        schema = pa.schema([(c, pa.string()) for c in self.columns() + [CODE_KEY, MONTH_KEY]])
+        dataset = ds.dataset(self.root, format="parquet", partitioning=partitioning, schema=schema)
+        expr = None
+        for clause in (
+            ds.field(MONTH_KEY) >= month_from if month_from else None,
+            ds.field(MONTH_KEY) <= month_to if month_to else None,
+            ds.field(CODE_KEY).isin(pa.array(list(codes), pa.string())) if codes is not None else None,  # typed, so an empty set works
+        ):
+            if clause is not None:
+                expr = clause if expr is None else expr & clause
+
+        wanted = list(self.columns() if columns is None else columns)
+        table = dataset.to_table(columns=wanted + [CODE_KEY], filter=expr)
+        return table.to_pandas()
+
+    def distinct_codes(self, month_from=None, month_to=None):
+        """Distinct normalized codes in the month range (reads only that column)."""
+        table = self.query(month_from=month_from, month_to=month_to, columns=[])
+        return pd.Series(table[CODE_KEY].unique(), dtype=object)
+
+    def months_between(self, month_from=None, month_to=None):
+        return [m for m in self.months() if (not month_from or m >= month_from) and (not month_to or m <= month_to)]
@@ -1,13 +1,20 @@
 import streamlit as st
 import pandas as pd
-import re
+import numpy as np
 import io
+import zipfile
+import artifact_store
+from sms_clean import normalize_number, filter_numbers, dedup_positions, parallel_normalize
+from worker_pool import get_pool, session_id, describe
 
 st.set_page_config(page_title="Mass SMS Cleaner", page_icon="🧹", layout="centered")
+artifact_store.install()  # spill uploads/downloads to disk
 
 st.title("Mass SMS Cleaner & Merger 🧹")
 st.write("Upload multiple Excel files. I will merge them, clean the numbers, and remove duplicates across the entire list.")
 
+BATCH_ORDERS = ["Original order", "Sort by number", "Shuffle", "Priority files first"]
+
 # --- SIDEBAR: CLEANING RULES ---
 st.sidebar.header("⚙️ Cleaning Rules")
 
@@ -21,48 +28,84 @@ opt_remove_dupes = st.sidebar.checkbox("Remove Duplicate Numbers (Global)", valu
 opt_filter_length = st.sidebar.checkbox("Keep ONLY 11-digit numbers", value=True)
 opt_filter_mobile = st.sidebar.checkbox("Keep ONLY starting with '09'", value=True)
 
+format_options = (opt_convert_digits, opt_remove_nondigits, opt_fix_prefix)
+
+st.sidebar.caption("3. Execution")
+opt_parallel = st.sidebar.checkbox(f"Multi-core mode ({get_pool().lanes['cpu'].slots} cores)", value=False,
+                                   help="Splits the number cleaning over worker processes. Worth it for lists of a few million rows.")
+
+st.sidebar.caption("4. Gateway Batches")
+opt_split_batches = st.sidebar.checkbox("Split into batch files (ZIP)", value=False,
+                                        help="For SMS gateways that limit how many numbers one upload can have.")
+if opt_split_batches:
+    batch_size = st.sidebar.number_input("Numbers per batch file", min_value=1, value=5000, step=500)
+    batch_format = st.sidebar.radio("Batch file type", ["csv", "txt"], horizontal=True)
+    batch_order_rule = st.sidebar.selectbox("Send order", BATCH_ORDERS)
+
 # --- HELPER FUNCTIONS ---
-def clean_single_number(number):
-    """Applies cleaning logic based on sidebar selections."""
-    if pd.isna(number) or str(number).strip() == "":
-        return None
-    
-    number = str(number).strip()
-
-    # 1. Translation (Farsi/Arabic -> English)
-    if opt_convert_digits:
-        farsi = '۰۱۲۳۴۵۶۷۸۹'
-        arabic = '٠١٢٣٤٥٦٧٨٩'
-        english = '0123456789'
-        mapping = str.maketrans(farsi + arabic, english * 2)
-        number = number.translate(mapping)
-
-    # 2. Handle Prefixes (do +98 / 0098 BEFORE stripping non-digits)
-    if opt_fix_prefix:
-        if number.startswith('+98'):
-            number = '0' + number[3:]
-        elif number.startswith('0098'):
-            number = '0' + number[4:]
-
-    # 3. Remove Non-Digits
-    if opt_remove_nondigits:
-        number = re.sub(r'\D', '', number)
-
-    # 4. Handle Prefixes (after stripping non-digits)
-    if opt_fix_prefix:
-        if number.startswith('98') and len(number) > 10:
-            number = '0' + number[2:]
-        elif number.startswith('9') and len(number) == 10:
-            number = '0' + number
-
-    # --- VALIDATION CHECKS ---
-    if opt_filter_length and len(number) != 11:
-        return None
+def batch_positions(numbers, sources, rule, priority_files, dedupe, kept=None):
+    """Row positions of the final list, in send order.
 
-    if opt_filter_mobile and not number.startswith("09"):
-        return None
+    Works on positions only, so the final frame is never built. With a
+    priority rule the dedup runs after reordering, so a number that is in
+    several files is credited to the highest-priority one. `kept` are the
+    dedup stage's positions, reused when the order doesn't affect which
+    copy wins.
+    """
+    if kept is not None and rule != "Priority files first":
+        pos, dedupe = kept, False
+    else:
+        pos = np.flatnonzero(numbers.notna().to_numpy())
+    if rule == "Priority files first":
+        rank = sources.map({f: i for i, f in enumerate(priority_files)}).fillna(len(priority_files)).to_numpy()
+        pos = pos[np.argsort(rank[pos], kind="stable")]
+    if dedupe:
+        pos = pos[~numbers.iloc[pos].duplicated().to_numpy()]
+    if rule == "Sort by number":
+        pos = pos[np.argsort(numbers.iloc[pos].to_numpy(dtype=str), kind="stable")]
+    elif rule == "Shuffle":
+        pos = np.random.default_rng().permutation(pos)  # not in place: `kept` is the dedup stage's cached output
+    return pos
+
+def write_batches(zf, numbers, sources, pos, size, fmt):
+    """Writes one file per `size` numbers into the open ZIP; yields a manifest row per batch."""
+    n_batches = -(-len(pos) // size)
+    width = len(str(n_batches))
+    for b in range(n_batches):
+        chunk = pos[b * size:(b + 1) * size]
+        values = numbers.iloc[chunk]
+        name = f"batch_{b + 1:0{width}d}.{fmt}"
+        if fmt == "csv":
+            # Quoted as needed: with "Remove non-digits" off a value can hold a comma or a quote
+            zf.writestr(name, values.rename("Mobile").to_csv(index=False, lineterminator="\n"))
+        else:
+            zf.writestr(name, "\n".join(values) + "\n")
+        per_source = sources.iloc[chunk].value_counts(sort=False)
+        yield {
+            "Batch": b + 1,
+            "File": name,
+            "Count": len(chunk),
+            "First": values.iloc[0],
+            "Last": values.iloc[-1],
+            "Sources": ", ".join(f"{src}: {n}" for src, n in per_source.items()),
+        }
 
-    return number
+def run_stage(name, key, compute):
+    """Output of one pipeline stage, recomputed only when its key changes.
+
+    Keys hold the stage's inputs (the upstream key) plus the options that
+    stage reads, so toggling a filter option reuses the read and normalize
+    outputs and reruns only the steps after it. One entry per stage per
+    session.
+    """
+    memo = st.session_state.setdefault("sms_stages", {})
+    if name in memo and memo[name][0] == key:
+        reused_stages.append(name)
+        return memo[name][1]
+    value = compute()
+    memo[name] = (key, value)
+    ran_stages.append(name)
+    return value
 
 def read_file(uploaded_file):
     """Reads CSV or Excel and returns a DataFrame."""
@@ -86,55 +129,100 @@ uploaded_files = st.file_uploader(
 if uploaded_files:
     st.info(f"📂 {len(uploaded_files)} files selected.")
     
+    priority_files = []
+    if opt_split_batches and batch_order_rule == "Priority files first":
+        priority_files = st.multiselect("Priority files (sent first, in this order)",
+                                        [f.name for f in uploaded_files])
+    
+    # Pressing the button turns the pipeline on for this set of files; after that,
+    # every rerun (e.g. a toggled sidebar option) reruns only the stages it affects
+    files_key = tuple((f.file_id, f.name, f.size) for f in uploaded_files)
     if st.button("🚀 Merge & Clean All"):
-        all_dfs = []
+        st.session_state.sms_active = files_key
+
+    if st.session_state.get("sms_active") == files_key:
+        reused_stages, ran_stages = [], []
         progress_bar = st.progress(0)
         status_text = st.empty()
-        
+        pool, session = get_pool(), session_id()
+        show_queue = lambda s: status_text.text(describe(s))
+
         # Step A: Read and Merge
-        for i, file in enumerate(uploaded_files):
-            status_text.text(f"Reading file {i+1}/{len(uploaded_files)}: {file.name}")
-            df_temp = read_file(file)
-            if df_temp is not None:
-                df_temp['_source_file'] = file.name
-                all_dfs.append(df_temp)
-            progress_bar.progress((i + 1) / (len(uploaded_files) * 2))
-
-        if not all_dfs:
+        def read_and_merge():
+            all_dfs = []
+            with pool.slot(session, "cpu", on_wait=show_queue):
+                for i, file in enumerate(uploaded_files):
+                    status_text.text(f"Reading file {i+1}/{len(uploaded_files)}: {file.name}")
+                    df_temp = read_file(file)
+                    if df_temp is not None:
+                        df_temp['_source_file'] = file.name
+                        all_dfs.append(df_temp)
+                    progress_bar.progress((i + 1) / (len(uploaded_files) * 2))
+
+                if not all_dfs:
+                    return None, None
+
+                status_text.text("Merging files...")
+                full_df = pd.concat(all_dfs, ignore_index=True)
+
+            # Step B: Identify Column
+            cols = full_df.columns.tolist()
+            target_col = None
+            possible_names = ['mobile', 'phone', 'cell', 'شماره', 'tel', 'mob']
+            for col in cols:
+                if any(x in str(col).lower() for x in possible_names):
+                    target_col = col
+                    break
+            
+            if not target_col:
+                target_col = cols[0]
+            return full_df, target_col
+
+        full_df, target_col = run_stage("read", files_key, read_and_merge)
+        if full_df is None:
             st.error("No valid data found.")
             st.stop()
-
-        status_text.text("Merging files...")
-        full_df = pd.concat(all_dfs, ignore_index=True)
         initial_count = len(full_df)
 
-        # Step B: Identify Column
-        cols = full_df.columns.tolist()
-        target_col = None
-        possible_names = ['mobile', 'phone', 'cell', 'شماره', 'tel', 'mob']
-        for col in cols:
-            if any(x in str(col).lower() for x in possible_names):
-                target_col = col
-                break
-        
-        if not target_col:
-            target_col = cols[0]
+        # Step C: Normalize (formatting rules)
+        def normalize():
+            if opt_parallel:
+                status_text.text(f"Cleaning numbers on {pool.lanes['cpu'].slots} cores...")
+                return pd.Series(parallel_normalize(full_df[target_col], format_options, session, show_queue), dtype=object)
+            with pool.slot(session, "cpu", on_wait=show_queue):
+                status_text.text("Cleaning numbers...")
+                return full_df[target_col].apply(normalize_number, args=format_options).astype(object)
+
+        normalize_key = (files_key, format_options)
+        normalized = run_stage("normalize", normalize_key, normalize)
 
-        # Step C: Cleaning
-        status_text.text("Cleaning numbers...")
-        full_df['Cleaned_Mobile'] = full_df[target_col].apply(clean_single_number)
-        
         # Step D: Filter & Deduplicate
-        valid_df = full_df.dropna(subset=['Cleaned_Mobile'])
-        
-        final_df = valid_df.copy()
-        dupe_count = 0
-        
-        if opt_remove_dupes:
+        filter_key = normalize_key + (opt_filter_length, opt_filter_mobile)
+        cleaned = run_stage("filter", filter_key, lambda: filter_numbers(normalized, opt_filter_length, opt_filter_mobile))
+        valid_count = int(cleaned.notna().sum())
+
+        def dedup():
+            if not opt_remove_dupes:
+                return np.flatnonzero(cleaned.notna().to_numpy())
             status_text.text("Removing global duplicates...")
-            before_dedup = len(final_df)
-            final_df = final_df.drop_duplicates(subset=['Cleaned_Mobile'])
-            dupe_count = before_dedup - len(final_df)
+            # Single process even in multi-core mode: shipping the numbers to
+            # workers costs more than the hash-based duplicated() itself
+            with pool.slot(session, "cpu", on_wait=show_queue):
+                return dedup_positions(cleaned)
+
+        dedup_key = filter_key + (opt_remove_dupes,)
+        kept = run_stage("dedup", dedup_key, dedup)
+
+        if opt_split_batches:
+            # Batch mode works on row positions only; numbers go straight into the ZIP below
+            positions = run_stage("order", dedup_key + (batch_order_rule, tuple(priority_files)),
+                                  lambda: batch_positions(cleaned, full_df['_source_file'], batch_order_rule,
+                                                          priority_files, opt_remove_dupes, kept))
+        else:
+            positions = kept
+        dupe_count = valid_count - len(positions)
+        final_count = len(positions)
+        preview_df = full_df.iloc[positions[:10]].assign(Cleaned_Mobile=cleaned.iloc[positions[:10]].to_numpy())
 
         progress_bar.progress(1.0)
         status_text.text("Done!")
@@ -147,7 +235,7 @@ if uploaded_files:
         c1, c2, c3 = st.columns(3)
         c1.metric("Total Rows", initial_count)
         c2.metric("Duplicates Removed", dupe_count)
-        c3.metric("Final Valid List", len(final_df))
+        c3.metric("Final Valid List", final_count)
         
         # 2. Preview Table
         st.write("### 👁️ Preview of Final Data")
@@ -156,28 +244,56 @@ if uploaded_files:
         # We show the Source File, Original Number, and Cleaned Number for comparison
         preview_cols = ['_source_file', target_col, 'Cleaned_Mobile']
         # Add any other cols if they exist but ensure we don't crash
-        preview_cols = [c for c in preview_cols if c in final_df.columns]
+        preview_cols = [c for c in preview_cols if c in preview_df.columns]
         
-        st.dataframe(final_df[preview_cols].head(10), use_container_width=True)
+        st.dataframe(preview_df[preview_cols], use_container_width=True)
 
-        # 3. Download
-        output_buffer = io.BytesIO()
-        
-        if len(final_df) > 100000:
+        # 3. Download (built once per result). The bytes stay in the stage memo:
+        # download_button needs them on every rerun.
+        def export():
+            ext = "zip" if opt_split_batches else "csv" if final_count > 100000 else "xlsx"
+            out = io.BytesIO()
+            with pool.slot(session, "cpu", on_wait=show_queue):
+                status_text.text("Writing export...")
+                if opt_split_batches:
+                    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+                        manifest = list(write_batches(zf, cleaned, full_df['_source_file'],
+                                                      positions, int(batch_size), batch_format))
+                        manifest_df = pd.DataFrame(manifest, columns=["Batch", "File", "Count", "First", "Last", "Sources"])
+                        zf.writestr("manifest.csv", manifest_df.to_csv(index=False))
+                    info = {"label": f"⬇️ Download {len(manifest)} Batch Files (zip)", "file_name": "merged_cleaned_batches.zip",
+                            "mime": "application/zip", "manifest": manifest_df}
+                else:
+                    final_df = full_df.iloc[positions].assign(Cleaned_Mobile=cleaned.iloc[positions].to_numpy())
+                    if ext == "csv":
+                        final_df.to_csv(out, index=False)
+                        mime_type = "text/csv"
+                    else:
+                        with pd.ExcelWriter(out, engine='xlsxwriter') as writer:
+                            final_df.to_excel(writer, index=False)
+                        mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    info = {"label": f"⬇️ Download Final List ({ext})", "file_name": f"merged_cleaned_list.{ext}",
+                            "mime": mime_type, "manifest": None}
+            return out.getvalue(), info
+
+        export_key = (dedup_key, opt_split_batches) + ((int(batch_size), batch_format, batch_order_rule, tuple(priority_files))
+                                                       if opt_split_batches else ())
+        export_data, info = run_stage("export", export_key, export)
+        status_text.text("Done!")
+        st.caption(f"♻️ Reused: {', '.join(reused_stages) or '—'} · 🔄 Ran: {', '.join(ran_stages) or '—'}")
+
+        if info["manifest"] is not None:
+            st.write("### 📦 Batch Manifest")
+            st.dataframe(info["manifest"], use_container_width=True, hide_index=True)
+        elif info["mime"] == "text/csv":
             st.warning("⚠️ File is large (>100k rows), downloading as CSV.")
-            final_df.to_csv(output_buffer, index=False)
-            mime_type = "text/csv"
-            ext = "csv"
-        else:
-            with pd.ExcelWriter(output_buffer, engine='xlsxwriter') as writer:
-                final_df.to_excel(writer, index=False)
-            mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            ext = "xlsx"
-            
+
         st.download_button(
-            label=f"⬇️ Download Final List ({ext})",
-            data=output_buffer.getvalue(),
-            file_name=f"merged_cleaned_list.{ext}",
-            mime=mime_type,
+            label=info["label"],
+            data=export_data,
+            file_name=info["file_name"],
+            mime=info["mime"],
             type="primary"
-        )
\ No newline at end of file
+        )
+else:
+    st.session_state.pop("sms_stages", None)  # files removed: free the cached stages
@@ -5,7 +5,9 @@ from bs4 import BeautifulSoup
 from PIL import Image
 import io
 import zipfile
-import concurrent.futures
+import uuid
+import artifact_store
+from worker_pool import get_pool, session_id, describe
 
 # ⚠️ WEBSITE-SPECIFIC SELECTOR ⚠️
 # The line below is customized for janebi.com.
@@ -24,7 +26,14 @@ import concurrent.futures
 # If no image is found, this selector is the FIRST thing you should change.
 # img_tag = soup.find("img", {"id": "main_product_image"})
 
+# Product fields read from the page (schema.org microdata / Open Graph; adjust per site like the image selector)
+DEFAULT_FIELDS = """title = meta[property="og:title"] @content | h1
+price = [itemprop=price] @content | [itemprop=price] | meta[property="product:price:amount"] @content
+availability = [itemprop=availability] @href | [itemprop=availability] @content | [itemprop=availability]
+sku = [itemprop=sku] @content | [itemprop=sku]"""
+
 st.set_page_config(page_title="Product Image Scraper", page_icon="🖼️", layout="centered")
+artifact_store.install()  # spill uploads/downloads to disk
 
 st.title("High-Speed Image Scraper ⚡")
 
@@ -39,9 +48,24 @@ img_quality = st.sidebar.slider("JPEG Quality", 10, 100, 85) if img_format == "J
 
 st.sidebar.divider()
 
+# PRODUCT DATA
+st.sidebar.header("🏷️ Product Data")
+manifest_format = st.sidebar.selectbox("Data Manifest in ZIP", ["CSV", "XLSX", "Off"],
+                                       help="Title, price, etc. read from the same page the image comes from.")
+field_spec = st.sidebar.text_area(
+    "Fields (name = CSS selector @attribute)",
+    DEFAULT_FIELDS,
+    height=130,
+    help="One field per line. Without @attribute the element's text is used. "
+         "Alternatives separated by | are tried in order.",
+    disabled=manifest_format == "Off",
+)
+
+st.sidebar.divider()
+
 # SPEED SETTINGS
 st.sidebar.header("🚀 Speed Control")
-max_threads = st.sidebar.slider("Concurrent Downloads", 1, 20, 10, help="Higher = Faster, but risk of getting blocked.")
+max_threads = st.sidebar.slider("Concurrent Downloads", 1, 20, 10, help="Higher = Faster, but risk of getting blocked. The server also caps downloads across all users.")
 
 # --- HELPER FUNCTIONS ---
 def sanitize_filename(name):
@@ -69,8 +93,45 @@ def load_google_sheet(url):
         st.error(f"❌ Error loading sheet: {e}")
         return None
 
-def process_single_url(url, width, height, fmt, qual):
-    """Worker function for threading."""
+def parse_fields(spec):
+    """'name = sel @attr | sel2' lines -> {name: [(selector, attr or None), ...]}."""
+    fields = {}
+    for line in spec.splitlines():
+        if "=" not in line:
+            continue
+        name, rules = line.split("=", 1)
+        candidates = []
+        for rule in rules.split("|"):
+            selector, _, attr = rule.partition("@")
+            if selector.strip():
+                candidates.append((selector.strip(), attr.strip() or None))
+        if name.strip() and candidates:
+            fields[name.strip()] = candidates
+    return fields
+
+def extract_fields(soup, fields):
+    """First non-empty match per field, from the already-parsed page."""
+    values = {}
+    for name, candidates in fields.items():
+        values[name] = ""
+        for selector, attr in candidates:
+            try:
+                el = soup.select_one(selector)
+            except Exception:  # bad selector typed in the sidebar
+                continue
+            if el is None:
+                continue
+            value = el.get(attr) if attr else el.get_text(" ", strip=True)
+            if isinstance(value, list):  # e.g. class
+                value = " ".join(value)
+            if value and value.strip():
+                values[name] = " ".join(value.split())
+                break
+    return values
+
+def process_single_url(url, width, height, fmt, qual, fields=None):
+    """Worker function for threading. Returns (filename, image bytes, error, product data)."""
+    meta = {}
     try:
         # Pretend to be Chrome
         headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
@@ -79,11 +140,13 @@ def process_single_url(url, width, height, fmt, qual):
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, "html.parser")
+        if fields:
+            meta = extract_fields(soup, fields)  # same parsed page, no extra request
 
         # 2. Find Image
         img_tag = soup.find("img", {"id": "main_product_image"})
         if not img_tag:
-            return None, None, f"No image tag found"
+            return None, None, f"No image tag found", meta
 
         img_url = img_tag.get("data-zoom-image") or img_tag.get("src")
         if img_url.startswith("//"):
@@ -124,10 +187,12 @@ def process_single_url(url, width, height, fmt, qual):
             else:
                 background.save(img_byte_arr, format="PNG")
                 
-            return filename, img_byte_arr.getvalue(), None
+            return filename, img_byte_arr.getvalue(), None, meta
             
     except Exception as e:
-        return None, None, str(e)
+        return None, None, str(e), meta
+
+fields = parse_fields(field_spec) if manifest_format != "Off" else None
 
 # --- MAIN INPUT SECTION ---
 input_method = st.radio("Choose Input Method:", ["🔗 Single Link", "📂 Upload File", "☁️ Google Sheet"], horizontal=True)
@@ -139,7 +204,9 @@ if input_method == "🔗 Single Link":
     single_url = st.text_input("Enter Product URL:")
     if single_url and st.button("🚀 Process Link"):
         with st.spinner("Processing..."):
-            fname, img_bytes, error = process_single_url(single_url, target_w, target_h, img_format, img_quality)
+            fname, img_bytes, error, meta = process_single_url(single_url, target_w, target_h, img_format, img_quality, fields)
+            if meta:
+                st.dataframe(pd.DataFrame([meta]), hide_index=True)
             if img_bytes:
                 st.image(img_bytes, caption=fname, width=300)
                 st.download_button(label="⬇️ Download", data=img_bytes, file_name=fname, mime=f"image/{img_format.lower()}")
@@ -177,56 +244,76 @@ else:
             # --- PARALLEL EXECUTION ---
             progress_bar = st.progress(0)
             status_text = st.empty()
-            zip_buffer = io.BytesIO()
             
-            results_data = [] # Store successful file data
+            saved_names = set() # Names already in the ZIP
             errors_log = []   # Store errors
+            manifest_rows = {}  # input position -> URL, image filename, product data
             
-            # Create a ThreadPool
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-                # Submit all tasks
-                future_to_url = {executor.submit(process_single_url, url, target_w, target_h, img_format, img_quality): url for url in urls}
-                
-                completed_count = 0
-                
-                # Process as they finish
-                for future in concurrent.futures.as_completed(future_to_url):
-                    url = future_to_url[future]
-                    completed_count += 1
+            # Images go straight into a ZIP on disk as they finish, instead of piling up in memory
+            with artifact_store.scratch_path(".zip") as zip_path:
+                with zipfile.ZipFile(zip_path, "w") as zf:
+                    # Queue on the server-wide download lane (shared with everyone scraping right now)
+                    pool, session = get_pool(), session_id()
+                    # Submit all tasks; at most max_threads of ours hit the site at once
+                    future_to_url = {pool.submit(session, "io", process_single_url, url, target_w, target_h, img_format, img_quality, fields, cap=max_threads): (i, url)
+                                     for i, url in enumerate(urls)}
                     
-                    try:
-                        fname, img_bytes, error = future.result()
-                        if img_bytes:
-                            results_data.append((fname, img_bytes))
-                        else:
-                            errors_log.append(f"{url} -> {error}")
-                    except Exception as exc:
-                         errors_log.append(f"{url} -> {exc}")
+                    completed_count = 0
                     
-                    # Update UI
-                    progress_pct = completed_count / len(urls)
-                    progress_bar.progress(progress_pct)
-                    status_text.text(f"Processed {completed_count}/{len(urls)}")
-
-            # --- SAVE TO ZIP ---
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for fname, data in results_data:
-                    # Handle duplicate names by prepending a number if needed, or rely on unique content
-                    # Simple duplicate handler:
-                    if fname in zf.namelist():
-                        import uuid
-                        fname = f"{uuid.uuid4().hex[:4]}_{fname}"
-                    zf.writestr(f"images/{fname}", data)
-                
-                # Save error log if any
-                if errors_log:
-                    zf.writestr("errors.txt", "\n".join(errors_log))
+                    # Process as they finish
+                    for future in pool.as_completed(session, "io", future_to_url,
+                                                    on_wait=lambda s: status_text.text(f"Processed {completed_count}/{len(urls)} · {describe(s)}")):
+                        i, url = future_to_url[future]
+                        completed_count += 1
+                        
+                        meta, fname, error = {}, None, None
+                        try:
+                            fname, img_bytes, error, meta = future.result()
+                            if img_bytes:
+                                # Simple duplicate handler:
+                                if fname in saved_names:
+                                    fname = f"{uuid.uuid4().hex[:4]}_{fname}"
+                                saved_names.add(fname)
+                                zf.writestr(f"images/{fname}", img_bytes)
+                            else:
+                                fname = None
+                                errors_log.append(f"{url} -> {error}")
+                        except Exception as exc:
+                             error = str(exc)
+                             errors_log.append(f"{url} -> {exc}")
+                        if fields:
+                            manifest_rows[i] = {"URL": url, "Image File": f"images/{fname}" if fname else "",
+                                                **{name: meta.get(name, "") for name in fields}, "Error": error or ""}
+                        
+                        # Update UI
+                        progress_pct = completed_count / len(urls)
+                        progress_bar.progress(progress_pct)
+                        status_text.text(f"Processed {completed_count}/{len(urls)}")
+                    
+                    # Save error log if any
+                    if errors_log:
+                        zf.writestr("errors.txt", "\n".join(errors_log))
 
-            st.success(f"✅ Finished! {len(results_data)} images scraped. {len(errors_log)} errors.")
-            
-            st.download_button(
-                label="⬇️ Download ZIP",
-                data=zip_buffer.getvalue(),
-                file_name="fast_images.zip",
-                mime="application/zip"
-            )
\ No newline at end of file
+                    # Product data, one row per URL in input order
+                    if fields:
+                        manifest_df = pd.DataFrame([manifest_rows[i] for i in sorted(manifest_rows)])
+                        if manifest_format == "XLSX":
+                            manifest_buffer = io.BytesIO()
+                            with pd.ExcelWriter(manifest_buffer, engine="xlsxwriter") as writer:
+                                manifest_df.to_excel(writer, index=False, sheet_name="Products")
+                            zf.writestr("products.xlsx", manifest_buffer.getvalue())
+                        else:
+                            zf.writestr("products.csv", manifest_df.to_csv(index=False).encode("utf-8-sig"))  # BOM: Excel reads Persian right
+
+                st.success(f"✅ Finished! {len(saved_names)} images scraped. {len(errors_log)} errors.")
+                if fields:
+                    with st.expander("🏷️ Product Data Preview"):
+                        st.dataframe(manifest_df.head(20), hide_index=True)
+                
+                with open(zip_path, "rb") as zip_file:
+                    st.download_button(
+                        label="⬇️ Download ZIP",
+                        data=zip_file,
+                        file_name="fast_images.zip",
+                        mime="application/zip"
+                    )
\ No newline at end of file
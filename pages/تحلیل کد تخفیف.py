@@ -1,44 +1,390 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
 import re
+import contextlib
+import fnmatch
+from order_store import OrderStore, CODE_KEY
+import artifact_store
+from worker_pool import get_pool, session_id, describe
 
 st.set_page_config(page_title="Discount Code Matcher", page_icon="🎫", layout="centered")
+artifact_store.install()  # spill uploads/downloads to disk
 
 st.title("Discount Code Matcher & Analyzer")
 
 # --- HELPER: CLEAN CURRENCY ---
-def clean_currency(value):
-    """Converts string currency (e.g., '12,000', '۱۲۰۰۰') to float."""
-    if pd.isna(value):
-        return 0.0
-    s = str(value)
-    # 1. Replace Persian digits
-    farsi = '۰۱۲۳۴۵۶۷۸۹'
-    english = '0123456789'
-    mapping = str.maketrans(farsi, english)
-    s = s.translate(mapping)
-    # 2. Remove commas and non-numeric chars (except decimal)
-    s = re.sub(r'[^\d.]', '', s)
+# Persian (۰-۹) and Arabic-Indic (٠-٩) digits -> ASCII,
+# Arabic decimal separator (٫) -> '.', thousands separators (٬ ، ,) dropped
+CURRENCY_TRANSLATION = str.maketrans({
+    **{c: str(i) for i, c in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{c: str(i) for i, c in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    '٫': '.',
+    '٬': None,
+    '،': None,
+    ',': None,
+})
+
+def parse_currency_column(series):
+    """Converts a column of currency strings (e.g. '12,000', '۱۲٬۰۰۰ تومان') to float64.
+
+    Works on the distinct values only (prices repeat a lot in order exports)
+    and uses vectorized string ops + pd.to_numeric instead of a per-cell apply.
+    Empty cells become 0.0; so do unparseable ones, which are also counted.
+    Returns (float64 Series, number of unparseable cells).
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    cleaned = (
+        pd.Series(uniques, dtype=object).astype(str)
+        .str.translate(CURRENCY_TRANSLATION)
+        .str.replace(r'[^\d.]', '', regex=True)  # currency suffixes, spaces, etc.
+    )
+    parsed = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype='float64')
+
+    # A non-blank cell that still didn't parse is "unparseable"
+    blank = pd.Series(uniques, dtype=object).astype(str).str.strip().eq('').to_numpy()
+    bad_unique = np.isnan(parsed) & ~blank
+    bad_count = int(bad_unique[codes[codes >= 0]].sum())
+
+    values = np.append(np.nan_to_num(parsed, nan=0.0), 0.0)  # last slot: NaN cells (code -1)
+    return pd.Series(values[codes], index=series.index, dtype='float64'), bad_count
+
+# --- HELPER: CODE PATTERNS ---
+RANGE_PATTERN = re.compile(r'^([^*?\[]*)\[(\d+)-(\d+)\]([^*?\[]*)$')
+
+class _TrieNode:
+    __slots__ = ('children', 'exact', 'prefix', 'ranges', 'globs')
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None   # pattern ending exactly here
+        self.prefix = None  # 'literal*' pattern: anything may follow
+        self.ranges = []    # (lo, hi, min_width, max_width, suffix, pattern)
+        self.globs = []     # (compiled regex, pattern) for other wildcards
+
+class CodeMatcher:
+    """Matches order codes against exact codes and code families.
+
+    Supported entries (already lowercased):
+      ali10            exact code
+      ali-*            prefix
+      summer25_*_vip   wildcards (* = any text, ? = one character)
+      ali[100-250]     numeric range, optionally followed by a literal suffix
+
+    Everything is compiled into one trie keyed by the literal part of each
+    pattern. A code walks the trie once, and only the range/wildcard
+    patterns hanging off the nodes it passes through are checked, so cost
+    doesn't grow with the number of patterns. The deepest (most specific)
+    hit wins; an exact code always wins.
+    """
+
+    def __init__(self, patterns):
+        self.exact = {}
+        self.root = _TrieNode()
+        self.has_families = False
+        for pattern in dict.fromkeys(patterns):
+            if not pattern:
+                continue
+            range_match = RANGE_PATTERN.match(pattern)
+            if range_match:
+                literal, lo, hi, suffix = range_match.groups()
+                # Equal-width bounds (e.g. 001-250) mean zero-padded numbers
+                widths = (len(lo), len(hi)) if len(lo) == len(hi) else (1, len(hi))
+                self._node(literal).ranges.append((int(lo), int(hi), *widths, suffix, pattern))
+            elif '*' not in pattern and '?' not in pattern:
+                self.exact[pattern] = pattern
+                continue
+            elif pattern.endswith('*') and not any(c in pattern[:-1] for c in '*?'):
+                self._node(pattern[:-1]).prefix = pattern
+            else:
+                literal = re.split(r'[*?]', pattern, maxsplit=1)[0]
+                self._node(literal).globs.append((re.compile(fnmatch.translate(pattern)), pattern))
+            self.has_families = True
+
+    def _node(self, literal):
+        node = self.root
+        for ch in literal:
+            node = node.children.setdefault(ch, _TrieNode())
+        return node
+
+    @staticmethod
+    def _check_ranges(node, tail):
+        for lo, hi, min_w, max_w, suffix, pattern in node.ranges:
+            digits = tail[:len(tail) - len(suffix)] if suffix else tail
+            if (tail.endswith(suffix) and digits.isdigit() and min_w <= len(digits) <= max_w
+                    and (min_w == max_w or digits[0] != '0' or digits == '0') and lo <= int(digits) <= hi):
+                return pattern
+        return None
+
+    def match_one(self, code):
+        if code in self.exact:
+            return code
+        best = None
+        node = self.root
+        depth = 0
+        while True:
+            hit = self._check_ranges(node, code[depth:]) if node.ranges else None
+            if hit is None:
+                hit = next((p for rx, p in node.globs if rx.match(code)), None)
+            if hit is None:
+                hit = node.prefix
+            if hit is not None:
+                best = hit
+            if depth == len(code):
+                return best
+            node = node.children.get(code[depth])
+            if node is None:
+                return best
+            depth += 1
+
+    def match(self, series):
+        """Returns the matched pattern per code (NaN when nothing matched).
+
+        Only distinct codes are looked up; exact codes go through a dict map.
+        """
+        codes, uniques = pd.factorize(series)
+        uniques = pd.Series(uniques, dtype=object)
+        if self.has_families:
+            hits = np.array([self.match_one(u) for u in uniques], dtype=object)
+        else:
+            hits = uniques.map(self.exact).to_numpy(dtype=object)
+        hits = np.append(hits, None)  # slot for NaN codes (-1)
+        return pd.Series(hits[codes], index=series.index, dtype=object)
+
+# --- HELPER: BREAKDOWN CUBE ---
+PERIODS = {"Day": "D", "Week": "W", "Month": "M"}
+NO_PERIOD = "(no date)"
+JALALI_DATE = re.compile(r'^(\d{4})/(\d{1,2})(?:/(\d{1,2}))?(?!\d)')
+
+def jalali_to_gregorian(jy, jm, jd):
+    jy += 1595
+    days = -355668 + 365 * jy + (jy // 33) * 8 + ((jy % 33) + 3) // 4 + jd
+    days += (jm - 1) * 31 if jm < 7 else (jm - 7) * 30 + 186
+    gy = 400 * (days // 146097)
+    days %= 146097
+    if days > 36524:
+        days -= 1
+        gy += 100 * (days // 36524)
+        days %= 36524
+        if days >= 365:
+            days += 1
+    gy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        gy += (days - 1) // 365
+        days = (days - 1) % 365
+    leap = gy % 4 == 0 and (gy % 100 != 0 or gy % 400 == 0)
+    gd = days + 1
+    for gm, length in enumerate([31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], start=1):
+        if gd <= length:
+            break
+        gd -= length
+    return gy, gm, gd
+
+def gregorian_to_jalali(gy, gm, gd):
+    gy2 = gy + 1 if gm > 2 else gy
+    days = (355666 + 365 * gy + (gy2 + 3) // 4 - (gy2 + 99) // 100 + (gy2 + 399) // 400 + gd
+            + [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334][gm - 1])
+    jy = -1595 + 33 * (days // 12053)
+    days %= 12053
+    jy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        jy += (days - 1) // 365
+        days = (days - 1) % 365
+    if days < 186:
+        return jy, 1 + days // 31, 1 + days % 31
+    return jy, 7 + (days - 186) // 30, 1 + (days - 186) % 30
+
+def jalali_parts(text):
+    """'1403/5/12 10:30' -> (1403, 5, 12); day is None for '1403/05'. None if unparseable."""
+    m = JALALI_DATE.match(text)
+    if not m:
+        return None
+    year, month, day = int(m[1]), int(m[2]), int(m[3]) if m[3] else None
+    if not 1 <= month <= 12 or not (day is None or 1 <= day <= 31):
+        return None
+    return year, month, day
+
+def jalali_week_start(text):
+    """'1403/05/12' -> the Saturday its (Iranian) week starts on, as a Jalali date; None if unparseable."""
+    parts = jalali_parts(text)
+    if parts is None or parts[2] is None:
+        return None
     try:
-        return float(s)
-    except:
-        return 0.0
+        day = pd.Timestamp(*jalali_to_gregorian(*parts))
+    except ValueError:
+        return None
+    start = day - pd.Timedelta(days=(day.dayofweek - 5) % 7)  # Saturday = 5
+    return "%04d/%02d/%02d" % gregorian_to_jalali(start.year, start.month, start.day)
+
+def jalali_label(text, granularity):
+    """Zero-padded Day/Week/Month label for Jalali text, so '1403/5/3' and '1403/05/03' share a bucket."""
+    if granularity == "Week":
+        return jalali_week_start(text)
+    parts = jalali_parts(text)
+    if parts is None:
+        return None
+    if granularity == "Month":
+        return "%04d/%02d" % parts[:2]
+    return "%04d/%02d/%02d" % parts if parts[2] is not None else None
+
+def period_labels(series, granularity):
+    """Buckets an order-date column into day/week/month labels.
+
+    Gregorian dates are parsed; anything else (e.g. Jalali '1403/05/12')
+    is read as text and zero-padded per distinct value. Jalali weeks start
+    on Saturday, and are found by converting each distinct date to
+    Gregorian and back.
+    """
+    dates = pd.to_datetime(series, errors='coerce', format='mixed')
+    # Jalali years (14xx) also "parse", but with Gregorian month lengths
+    if dates.notna().sum() >= series.notna().sum() / 2 and dates.dt.year.median() > 1700:
+        periods = dates.dt.to_period(PERIODS[granularity])
+        if granularity == "Week":
+            return periods.dt.start_time.dt.strftime('%Y-%m-%d')
+        return periods.astype(str).where(dates.notna())
+
+    text = series.astype(str).str.strip().str.translate(CURRENCY_TRANSLATION).str.replace('-', '/')
+    codes, uniques = pd.factorize(text.where(series.notna()))
+    labels = np.append(np.array([jalali_label(u, granularity) for u in uniques], dtype=object), None)
+    return pd.Series(labels[codes], index=series.index, dtype=object)
+
+def build_breakdowns(codes, price, discount, periods=None, dims=None):
+    """Per-code / per-period / per-dimension aggregates from one grouped pass.
+
+    The matched orders are scanned once into a cube keyed by every chosen
+    key; each breakdown is then a roll-up of that (much smaller) cube.
+    Returns {sheet name: DataFrame}.
+    """
+    dims = dims or {}
+    frame = pd.DataFrame({'Code': codes, 'Gross': price, 'Discount': discount})
+    keys = ['Code']
+    if periods is not None:
+        # Orders without a usable date still count, under their own column
+        frame['Period'] = pd.Series(periods, dtype=object).fillna(NO_PERIOD).to_numpy()
+        keys.append('Period')
+    dims = {(f"{name} (dim)" if name in frame or name == 'Period' else name): values for name, values in dims.items()}
+    for name, values in dims.items():
+        frame[name] = values
+        keys.append(name)
+
+    cube = (
+        frame.groupby(keys, observed=True, dropna=False, sort=False)
+        .agg(Orders=('Gross', 'size'), Gross=('Gross', 'sum'), Discount=('Discount', 'sum'))
+        .reset_index()
+    )
+
+    def rollup(key, observed=True):
+        out = cube.groupby(key, observed=observed, dropna=False)[['Orders', 'Gross', 'Discount']].sum()
+        out['Net'] = out['Gross'] - out['Discount']
+        return out.reset_index()
+
+    # observed=False on the categorical keeps codes that had no orders
+    breakdowns = {"By Code": rollup('Code', observed=False).sort_values('Net', ascending=False)}
+    if periods is not None:
+        breakdowns["By Period"] = rollup('Period').sort_values('Period')
+        breakdowns["Code x Period (Net)"] = (
+            rollup(['Code', 'Period'])
+            .pivot_table(index='Code', columns='Period', values='Net', aggfunc='sum', fill_value=0, observed=True)
+            .reindex(breakdowns["By Code"]['Code'], fill_value=0)  # same rows as By Code, so they add up
+            .reset_index()
+        )
+    for name in dims:
+        breakdowns[f"By {name}"] = rollup(name).sort_values('Net', ascending=False)
+    return breakdowns
+
+def sheet_name(name, used):
+    """Excel sheet names: max 31 chars, no []:*?/\\, unique (ignoring case) among `used`."""
+    base = re.sub(r'[\[\]:*?/\\]', '_', str(name))[:31]
+    name, n = base, 2
+    while name.lower() in used:
+        suffix = f" ({n})"
+        name, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(name.lower())
+    return name
+
+@contextlib.contextmanager
+def cpu_slot():
+    """Waits for a free CPU slot on the server (showing the queue meanwhile), then holds it."""
+    queue_note = st.empty()
+    with get_pool().slot(session_id(), "cpu", on_wait=lambda s: queue_note.info(describe(s))):
+        queue_note.empty()
+        yield
+
+def read_orders(uploaded_file, nrows=None):
+    """nrows=0 reads just the headers (enough for the column pickers on every rerun)."""
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith('.csv'):
+        return pd.read_csv(uploaded_file, dtype=str, nrows=nrows)
+    return pd.read_excel(uploaded_file, dtype=str, nrows=nrows)
 
 # --- STEP 1: UPLOAD ORDERS ---
 st.subheader("1. Upload Orders File")
-orders_file = st.file_uploader("Upload the main file (Orders)", type=["xlsx", "csv"], key="orders")
+orders_source = st.radio("Orders Source:", ["📂 Upload File", "📦 Order Store"], horizontal=True,
+                         help="The Order Store keeps past exports as Parquet on the server, so you only upload new ones.")
 
 df_orders = None
-if orders_file:
-    try:
-        if orders_file.name.endswith('.csv'):
-            df_orders = pd.read_csv(orders_file, dtype=str)
-        else:
-            df_orders = pd.read_excel(orders_file, dtype=str)
-        st.success(f"✅ Loaded Orders: {len(df_orders)} rows")
-    except Exception as e:
-        st.error(f"Error loading orders: {e}")
+order_cols = None
+use_store = orders_source == "📦 Order Store"
+
+if not use_store:
+    orders_file = st.file_uploader("Upload the main file (Orders)", type=["xlsx", "csv"], key="orders")
+    if orders_file:
+        try:
+            with cpu_slot():
+                df_orders = read_orders(orders_file)
+            order_cols = df_orders.columns.tolist()
+            st.success(f"✅ Loaded Orders: {len(df_orders)} rows")
+        except Exception as e:
+            st.error(f"Error loading orders: {e}")
+else:
+    order_store = OrderStore()
+    store_meta = order_store.meta
+
+    with st.expander("📥 Add exports to the store", expanded=not store_meta):
+        ingest_files = st.file_uploader("Order exports", type=["xlsx", "csv"], accept_multiple_files=True, key="ingest")
+        if ingest_files:
+            try:
+                cols = read_orders(ingest_files[0], nrows=0).columns.tolist()
+
+                def pick(saved, hints):
+                    if saved in cols:
+                        return cols.index(saved)
+                    return next((i for i, c in enumerate(cols) if any(h in str(c).lower() for h in hints)), 0)
+
+                i1, i2, i3 = st.columns(3)
+                with i1:
+                    key_cols = st.multiselect(
+                        "Dedup Key (Order ID):", cols,
+                        default=[c for c in store_meta.get("key_cols", []) if c in cols] or [cols[pick(None, ['order', 'سفارش', 'id'])]],
+                        help="Rows with the same key replace older ones. Add the item column for line-item exports.")
+                with i2:
+                    ingest_date_col = st.selectbox("Order Date Column:", cols, index=pick(store_meta.get("date_col"), ['date', 'تاریخ']))
+                with i3:
+                    ingest_code_col = st.selectbox("Code Column:", cols, index=pick(store_meta.get("code_col"), ['code', 'کد تخفیف']))
+
+                if st.button("📥 Ingest into Store") and key_cols:
+                    total_dupes = 0
+                    with cpu_slot():
+                        for f in ingest_files:
+                            _, dupes = order_store.ingest(read_orders(f), key_cols, ingest_date_col, ingest_code_col)
+                            total_dupes += dupes
+                    st.success(f"✅ Ingested {len(ingest_files)} file(s). {total_dupes} duplicate orders replaced.")
+                    store_meta = order_store.meta
+            except Exception as e:
+                st.error(f"Error ingesting orders: {e}")
+
+    months = order_store.months()
+    if months:
+        month_from, month_to = (st.select_slider("Months:", options=months, value=(months[0], months[-1]))
+                                if len(months) > 1 else (months[0], months[0]))
+        order_cols = order_store.columns()
+        st.success(f"✅ Order Store: {order_store.row_count(order_store.months_between(month_from, month_to))} rows "
+                   f"in {len(order_store.months_between(month_from, month_to))} month(s)")
+    else:
+        st.info("The Order Store is empty. Add an export above.")
 
 # --- STEP 2: UPLOAD CODE LIST ---
 st.subheader("2. Upload Target Codes")
@@ -56,12 +402,11 @@ if codes_file:
         st.error(f"Error loading codes: {e}")
 
 # --- STEP 3: CONFIGURE & MATCH ---
-if df_orders is not None and df_codes is not None:
+if order_cols and df_codes is not None:
     st.divider()
     st.subheader("3. Configuration")
     
     col1, col2 = st.columns(2)
-    order_cols = df_orders.columns.tolist()
     
     with col1:
         # Match Settings
@@ -71,11 +416,18 @@ if df_orders is not None and df_codes is not None:
             if 'کد تخفیف' in str(c) or 'code' in str(c).lower():
                 def_ord_idx = i
                 break
-        target_col_orders = st.selectbox("Column in Orders (Code):", order_cols, index=def_ord_idx)
+        if use_store:
+            # Matching runs on the store's own normalized code column
+            target_col_orders = store_meta["code_col"]
+            st.caption(f"Code column in store: **{target_col_orders}**")
+        else:
+            target_col_orders = st.selectbox("Column in Orders (Code):", order_cols, index=def_ord_idx)
 
         # Code List Column
         code_cols = df_codes.columns.tolist()
-        target_col_codes = st.selectbox("Column in Code List:", code_cols, format_func=lambda x: f"Column {x+1}")
+        target_col_codes = st.selectbox("Column in Code List:", code_cols, format_func=lambda x: f"Column {x+1}",
+                                        help="Entries can be exact codes or families: ALI-* (prefix), "
+                                             "SUMMER25_*_VIP (wildcards * and ?), ALI[100-250] (numeric range).")
 
     with col2:
         # Financial Settings
@@ -97,29 +449,81 @@ if df_orders is not None and df_codes is not None:
                 break
         col_discount = st.selectbox("Discount Column:", order_cols, index=discount_idx)
 
+    # Breakdown Settings
+    st.markdown("##### 📅 Breakdown")
+    b1, b2, b3 = st.columns(3)
+    no_date = "— None —"
+    date_idx = 0
+    for i, c in enumerate(order_cols):
+        if 'تاریخ' in str(c) or 'date' in str(c).lower():
+            date_idx = i + 1
+            break
+    with b1:
+        col_date = st.selectbox("Order Date Column:", [no_date] + order_cols, index=date_idx)
+    with b2:
+        granularity = st.radio("Group Dates By:", list(PERIODS), horizontal=True)
+    with b3:
+        dim_cols = st.multiselect("Extra Dimensions (e.g. channel):", order_cols)
+
+    if use_store:
+        slim_load = st.checkbox("Load only the columns used in the analysis (faster, slimmer export)", value=False)
+
     if st.button("🚀 Match & Analyze"):
-        # --- A. MATCHING LOGIC ---
-        orders_series = df_orders[target_col_orders].astype(str).str.strip().str.lower()
-        codes_series = df_codes[target_col_codes].astype(str).str.strip().str.lower()
-        valid_codes_set = set(codes_series)
+        # Wait for a free CPU slot on the server, then match & aggregate here
+        with cpu_slot():
+            # --- A. MATCHING LOGIC ---
+            codes_series = df_codes[target_col_codes].astype(str).str.strip().str.lower()
+            matcher = CodeMatcher(codes_series)
+
+            if use_store:
+                # Only rows with a listed code (and in range) are read from disk
+                with st.spinner("Reading matching orders from the store..."):
+                    valid_codes_set = set(matcher.exact)
+                    if matcher.has_families:
+                        # Resolve families against the distinct codes in range (one column scan)
+                        distinct = order_store.distinct_codes(month_from, month_to)
+                        valid_codes_set = set(distinct[matcher.match(distinct).notna()])
+                    needed = None
+                    if slim_load:
+                        needed = list(dict.fromkeys(store_meta["key_cols"] + [target_col_orders, col_price, col_discount]
+                                                    + ([col_date] if col_date != no_date else []) + dim_cols))
+                    df_orders = order_store.query(codes=valid_codes_set, month_from=month_from, month_to=month_to,
+                                                  columns=needed)
+                orders_series = df_orders.pop(CODE_KEY)
+                total_orders = order_store.row_count(order_store.months_between(month_from, month_to))
+            else:
+                orders_series = df_orders[target_col_orders].astype(str).str.strip().str.lower()
+                total_orders = len(df_orders)
         
-        matched_mask = orders_series.isin(valid_codes_set)
-        matched_df = df_orders[matched_mask].copy()
-        unmatched_df = df_orders[~matched_mask]
+            matched_patterns = matcher.match(orders_series)
+            matched_mask = matched_patterns.notna()
+            matched_df = df_orders[matched_mask].copy()
+            matched_df['Matched Pattern'] = matched_patterns[matched_mask]
+            unmatched_df = df_orders[~matched_mask]
 
-        # --- B. FINANCIAL CALCULATIONS ---
-        # Clean columns to ensure they are numbers
-        matched_df['__clean_price'] = matched_df[col_price].apply(clean_currency)
-        matched_df['__clean_discount'] = matched_df[col_discount].apply(clean_currency)
+            # --- B. FINANCIAL CALCULATIONS ---
+            # Clean columns to ensure they are numbers
+            matched_df['__clean_price'], bad_price = parse_currency_column(matched_df[col_price])
+            matched_df['__clean_discount'], bad_discount = parse_currency_column(matched_df[col_discount])
 
-        # 1. Gross Income (Sum of Basket item price)
-        total_gross = matched_df['__clean_price'].sum()
+            # 1. Gross Income (Sum of Basket item price)
+            total_gross = matched_df['__clean_price'].sum()
 
-        # 2. Total Discount (Sum of مجموع مبلغ تخفیف)
-        total_discount = matched_df['__clean_discount'].sum()
+            # 2. Total Discount (Sum of مجموع مبلغ تخفیف)
+            total_discount = matched_df['__clean_discount'].sum()
 
-        # 3. Net Income (Price - Discount) <-- UPDATED HERE
-        total_net = total_gross - total_discount
+            # 3. Net Income (Price - Discount) <-- UPDATED HERE
+            total_net = total_gross - total_discount
+
+            # 4. Breakdowns (codes as categoricals over the uploaded code list)
+            code_cat = pd.Categorical(matched_df['Matched Pattern'], categories=list(dict.fromkeys(codes_series)))
+            breakdowns = build_breakdowns(
+                code_cat,
+                matched_df['__clean_price'].to_numpy(),
+                matched_df['__clean_discount'].to_numpy(),
+                periods=period_labels(matched_df[col_date], granularity).to_numpy() if col_date != no_date else None,
+                dims={c: matched_df[c].fillna('(empty)').to_numpy() for c in dim_cols},
+            )
 
         # --- C. DISPLAY REPORT ---
         st.divider()
@@ -131,7 +535,14 @@ if df_orders is not None and df_codes is not None:
         m2.metric("Total Discount", f"{total_discount:,.0f}")
         m3.metric("Net Income (Price - Discount)", f"{total_net:,.0f}", delta_color="normal")
 
-        st.info(f"Matched **{len(matched_df)}** orders out of **{len(df_orders)}** total.")
+        st.info(f"Matched **{len(matched_df)}** orders out of **{total_orders}** total.")
+        if bad_price or bad_discount:
+            st.warning(f"⚠️ Unparseable amounts counted as 0: {bad_price} price cells, {bad_discount} discount cells.")
+
+        st.write("### 🧮 Breakdowns")
+        for name, table in breakdowns.items():
+            with st.expander(name, expanded=(name == "By Code")):
+                st.dataframe(table, use_container_width=True, hide_index=True)
 
         # --- D. PREVIEW & DOWNLOAD ---
         st.write("### 👁️ Matched Orders Preview")
@@ -141,17 +552,24 @@ if df_orders is not None and df_codes is not None:
         matched_df = matched_df.drop(columns=['__clean_price', '__clean_discount'])
 
         output_buffer = io.BytesIO()
-        with pd.ExcelWriter(output_buffer, engine='xlsxwriter') as writer:
+        with cpu_slot(), pd.ExcelWriter(output_buffer, engine='xlsxwriter') as writer:
             matched_df.to_excel(writer, index=False, sheet_name="Matched")
-            unmatched_df.to_excel(writer, index=False, sheet_name="Unmatched")
+            if not use_store:  # the store never loads unmatched rows
+                unmatched_df.to_excel(writer, index=False, sheet_name="Unmatched")
             
             # Add a Summary Sheet
             summary_df = pd.DataFrame({
-                'Metric': ['Total Orders Processed', 'Matched Orders', 'Gross Income', 'Total Discount', 'Net Income'],
-                'Value': [len(df_orders), len(matched_df), total_gross, total_discount, total_net]
+                'Metric': ['Total Orders Processed', 'Matched Orders', 'Gross Income', 'Total Discount', 'Net Income',
+                           'Unparseable Price Cells', 'Unparseable Discount Cells'],
+                'Value': [total_orders, len(matched_df), total_gross, total_discount, total_net,
+                          bad_price, bad_discount]
             })
             summary_df.to_excel(writer, index=False, sheet_name="Summary")
 
+            used_sheets = {"matched", "unmatched", "summary"}
+            for name, table in breakdowns.items():
+                table.to_excel(writer, index=False, sheet_name=sheet_name(name, used_sheets))
+
         st.download_button(
             label="⬇️ Download Analysis (Excel)",
             data=output_buffer.getvalue(),
@@ -1,13 +1,17 @@
 import streamlit as st
 import pandas as pd
-import qrcode
-from PIL import Image
 import io
 import zipfile
-from urllib.parse import urlparse
 import requests
+import artifact_store
+from worker_pool import get_pool, session_id, describe
+from qr_render import (
+    FORMAT_EXT, FORMAT_MIME, generate_qr_pdf, get_slug, normalize_link,
+    cached_render, iter_rendered, unique_filename, render_cache, QRTemplate,
+)
 
 st.set_page_config(page_title="QR Code Generator", page_icon="🔗", layout="centered")
+artifact_store.install()  # spill uploads/downloads to disk
 
 st.title("Universal QR Code Generator 🔗")
 
@@ -27,6 +31,10 @@ else:
 box_size = st.sidebar.slider("Size (Box Pixel)", 10, 50, 20) 
 border_size = st.sidebar.slider("Border (Quiet Zone)", 0, 10, 4)
 
+# Output Settings
+output_format = st.sidebar.selectbox("Output Format", ["PNG", "SVG", "PDF"],
+                                     help="SVG/PDF are vector: they print sharp at any size, so keep Box Pixel small.")
+
 # --- HELPER FUNCTIONS ---
 @st.cache_data(ttl=600)  # Caches data for 10 mins so it's faster
 def load_google_sheet(url):
@@ -63,52 +71,38 @@ def load_google_sheet(url):
         st.warning("👉 Tip: Make sure the sheet is 'Anyone with the link' > 'Viewer'.")
         return None
 
-def generate_qr(link, fill_hex, back_hex_or_none, box, border):
-    """Generates a PIL Image of the QR code."""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=box,
-        border=border,
-    )
-    qr.add_data(link)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
-    
-    datas = img.getdata()
-    new_data = []
-    
-    # Convert hex to RGB tuple
-    fill_rgb = tuple(int(fill_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-    
-    if back_hex_or_none:
-        back_rgb = tuple(int(back_hex_or_none.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-    else:
-        back_rgb = (0, 0, 0, 0)
-
-    for item in datas:
-        if item[0] == 0: 
-            new_data.append(fill_rgb + (255,)) 
-        else:
-            if back_hex_or_none:
-                new_data.append(back_rgb + (255,))
-            else:
-                new_data.append((255, 255, 255, 0)) 
+@st.cache_resource(max_entries=8)
+def load_template(canvas_w, canvas_h, back_hex_or_none, logo_bytes, logo_ratio, caption_pos, font_bytes, font_size, text_hex):
+    """Decodes and pre-scales the branding layers once, not once per code."""
+    return QRTemplate(canvas_w, canvas_h, back_hex_or_none, logo_bytes, logo_ratio,
+                      caption_pos, font_bytes, font_size, text_hex)
 
-    img.putdata(new_data)
-    return img
+# --- BRANDING TEMPLATE ---
+template = None
+with st.sidebar.expander("🏷️ Branding Template (PNG)"):
+    use_template = st.checkbox("Add logo / caption", value=False)
+    logo_file = st.file_uploader("Logo (center)", type=["png", "jpg", "jpeg"], key="tpl_logo")
+    logo_ratio = st.slider("Logo Size (% of QR)", 10, 30, 22,
+                           help="Error correction switches to High when a logo is used.") / 100
+    caption_pos = st.radio("Product Slug Caption", ["below", "above", "none"], horizontal=True)
+    font_file = st.file_uploader("Caption Font (.ttf)", type=["ttf", "otf"], key="tpl_font")
+    font_size = st.slider("Caption Font Size", 10, 80, 28)
+    text_color = st.color_picker("Caption Color", "#000000")
+    canvas_w = st.number_input("Canvas Width (px)", min_value=100, max_value=4000, value=600)
+    canvas_h = st.number_input("Canvas Height (px)", min_value=100, max_value=4000, value=680)
 
-def get_slug(url):
-    """Extracts a clean filename from the URL."""
-    try:
-        parsed = urlparse(url)
-        slug = parsed.path.rsplit("/", 1)[-1]
-        if not slug:
-            return "qr_code"
-        return slug
-    except:
-        return "qr_code"
+    if use_template:
+        try:
+            template = load_template(
+                int(canvas_w), int(canvas_h), bg_color,
+                logo_file.getvalue() if logo_file else None, logo_ratio, caption_pos,
+                font_file.getvalue() if font_file else None, font_size, text_color,
+            )
+        except ValueError as e:
+            st.error(f"❌ Template doesn't fit: {e}")
+            st.stop()
+        if output_format != "PNG":
+            st.caption("ℹ️ Templates only apply to PNG output.")
 
 # --- MAIN INPUT SECTION ---
 input_method = st.radio("Choose Input Method:", ["🔗 Single Link", "📂 Upload File", "☁️ Google Sheet"], horizontal=True)
@@ -122,21 +116,27 @@ if input_method == "🔗 Single Link":
     
     if single_link:
         st.subheader("Preview & Download")
-        img = generate_qr(single_link, qr_color, bg_color, box_size, border_size)
+        try:
+            png_bytes = cached_render(single_link, "PNG", qr_color, bg_color, box_size, border_size, template)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+            st.stop()
         
         col1, col2 = st.columns([1, 2])
         with col1:
-            st.image(img, caption="QR Preview", width=250)
+            st.image(png_bytes, caption="QR Preview", width=250)
         with col2:
             # Prepare download
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
+            if output_format == "PDF":
+                data = generate_qr_pdf([single_link], qr_color, bg_color, box_size, border_size)
+            else:
+                data = cached_render(single_link, output_format, qr_color, bg_color, box_size, border_size, template)
             
             st.download_button(
                 label="⬇️ Download This QR Code",
-                data=img_byte_arr.getvalue(),
-                file_name=f"qr_{get_slug(single_link)}.png",
-                mime="image/png"
+                data=data,
+                file_name=f"qr_{get_slug(single_link)}.{FORMAT_EXT[output_format]}",
+                mime=FORMAT_MIME[output_format]
             )
 
 # === METHOD 2 & 3: BULK PROCESSING ===
@@ -180,40 +180,78 @@ else:
         if not df.empty:
             preview_url = str(df[link_column].iloc[0])
             st.caption(f"Previewing style using first row: {preview_url}")
-            preview_img = generate_qr(preview_url, qr_color, bg_color, box_size, border_size)
-            st.image(preview_img, width=150)
+            try:
+                preview_png = cached_render(preview_url, "PNG", qr_color, bg_color, box_size, border_size, template)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+                st.stop()
+            st.image(preview_png, width=150)
 
         # Generate Button
         if st.button("🚀 Generate All QR Codes"):
             links = df[link_column].dropna().tolist()
             
             progress_bar = st.progress(0)
-            zip_buffer = io.BytesIO()
-            
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for i, raw_link in enumerate(links):
-                    link = str(raw_link).strip()
-                    if not link: continue
-                    
-                    if not link.startswith(("http://", "https://")):
-                        link = "https://" + link
-
-                    img = generate_qr(link, qr_color, bg_color, box_size, border_size)
-                    
-                    img_byte_arr = io.BytesIO()
-                    img.save(img_byte_arr, format='PNG')
-                    
-                    filename = f"{get_slug(link)}.png"
-                    if filename in zf.namelist():
-                        filename = f"{get_slug(link)}_{i}.png"
-                    
-                    zf.writestr(filename, img_byte_arr.getvalue())
-                    progress_bar.progress((i + 1) / len(links))
+            status_text = st.empty()
+            pool, session = get_pool(), session_id()
+
+            # Keep the original row index: it feeds the "_i" filename suffix
+            indexed = [(i, normalize_link(raw_link)) for i, raw_link in enumerate(links)]
+            indexed = [(i, link) for i, link in indexed if link]
+
+            if output_format == "PDF":
+                # One multi-page vector sheet instead of a ZIP
+                pdf_links = [link for _, link in indexed]
+                with pool.slot(session, "cpu", on_wait=lambda s: status_text.text(describe(s))):
+                    status_text.text("Building PDF sheet...")
+                    pdf_bytes = generate_qr_pdf(pdf_links, qr_color, bg_color, box_size, border_size)
+                progress_bar.progress(1.0)
+
+                st.success(f"🎉 Done! {len(pdf_links)} pages.")
+                st.download_button(
+                    label="⬇️ Download PDF Sheet",
+                    data=pdf_bytes,
+                    file_name="qr_codes_bulk.pdf",
+                    mime="application/pdf"
+                )
+                st.stop()
+
+            ext = FORMAT_EXT[output_format]
+            used_names = set()
+            done = 0
             
-            st.success("🎉 Done!")
-            st.download_button(
-                label="⬇️ Download ZIP",
-                data=zip_buffer.getvalue(),
-                file_name="qr_codes_bulk.zip",
-                mime="application/zip"
-            )
\ No newline at end of file
+            # Build the ZIP on disk, not in a BytesIO
+            with artifact_store.scratch_path(".zip") as zip_path:
+                with zipfile.ZipFile(zip_path, "w") as zf:
+                    # Batches come back in input order, so filenames stay deterministic
+                    batches = iter_rendered([link for _, link in indexed], output_format,
+                                            qr_color, bg_color, box_size, border_size, template,
+                                            session=session, on_wait=lambda s: status_text.text(describe(s)))
+                    try:
+                        for rendered in batches:
+                            for data in rendered:
+                                i, link = indexed[done]
+                                zf.writestr(unique_filename(link, i, ext, used_names), data)
+                                done += 1
+                            progress_bar.progress(done / max(len(indexed), 1))
+                            status_text.text(f"Generated {done}/{len(indexed)}")
+                    except ValueError as e:
+                        # A long link can need more modules than the template's QR area holds
+                        st.error(f"❌ {e}")
+                        st.stop()
+                
+                st.success("🎉 Done!")
+                with open(zip_path, "rb") as zip_file:
+                    st.download_button(
+                        label="⬇️ Download ZIP",
+                        data=zip_file,
+                        file_name="qr_codes_bulk.zip",
+                        mime="application/zip"
+                    )
+
+# --- RENDER CACHE STATS ---
+st.sidebar.divider()
+st.sidebar.caption(
+    f"🗃️ Render cache: {render_cache.hits} hits / {render_cache.misses} misses · "
+    f"{len(render_cache)} items, {render_cache.size / 1024 / 1024:.1f} MB"
+)
\ No newline at end of file
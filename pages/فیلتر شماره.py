@@ -3,6 +3,9 @@ import pandas as pd
 import io
 import re
 import csv
+import numpy as np
+import artifact_store
+from worker_pool import get_pool, session_id, describe
 
 # --- Helper Function: Smart Normalization ---
 def standardize_iranian_number(val):
@@ -21,29 +24,154 @@ def standardize_iranian_number(val):
     else:
         return digits_only
 
+def standardize_iranian_numbers(series):
+    """Vectorized standardize_iranian_number for an Arrow string column."""
+    # Arrow's regex engine has an ASCII-only \D; \p{Nd} keeps Persian digits like re does
+    digits_only = series.str.strip().str.replace(r'[^\p{Nd}]', '', regex=True)
+    return digits_only.str[-10:]
+
+# --- Helper: Multi-Key Matching ---
+# Each key type gets its own normalizer and its own blocklist, so a phone
+# number can never collide with a customer ID.
+# Phone columns are guessed by a hint anywhere in the header; email and ID
+# only by an exact header name ('id' is in "paid", "valid", row numbers...),
+# since a wrong guess there silently removes rows.
+KEY_TYPES = {
+    "phone": {"label": "📱 Phone", "hints": ['mob', 'phone', 'tel', 'cell', 'شماره', 'موبایل']},
+    "email": {"label": "✉️ Email", "names": ['email', 'e-mail', 'mail', 'ایمیل']},
+    "id": {"label": "🆔 Customer ID",
+           "names": ['customer id', 'customer_id', 'customerid', 'user id', 'user_id', 'userid', 'کد مشتری', 'شناسه مشتری']},
+}
+NO_COLUMN = "— None —"
+
+def normalize_key(series, key_type, use_smart):
+    if key_type == "phone":
+        return standardize_iranian_numbers(series) if use_smart else series.str.strip()
+    if key_type == "email":
+        return series.str.strip().str.lower()
+    return series.str.strip()
+
+def typed_keys(df, mapping, use_smart):
+    """{key type: normalized keys} for the mapped columns of a file.
+
+    Values go to Arrow strings before normalizing, so the string ops run in
+    Arrow and no Python object is made per key. The index holds the row
+    position.
+    """
+    keys = {}
+    for key_type, col in mapping.items():
+        if col is None or col not in df.columns:
+            continue
+        values = df[col]
+        values = values[values.notna()].astype("string[pyarrow]")
+        normalized = normalize_key(values, key_type, use_smart)
+        keys[key_type] = normalized[normalized != ""]
+    return keys
+
+def guess_column(columns, key_type, preferred=None):
+    """Index into [NO_COLUMN] + columns: the preferred name, else a header match."""
+    options = [NO_COLUMN] + list(columns)
+    if preferred in columns:
+        return options.index(preferred)
+    info = KEY_TYPES[key_type]
+    for i, c in enumerate(columns):
+        header = str(c).strip().lower()
+        if header in info.get("names", ()) or any(h in header for h in info.get("hints", ())):
+            return i + 1
+    return 0
+
+# --- Helper: Removal Attribution ---
+def build_blocklist(file_keys):
+    """Merges per-file keys into a hash index plus a source bitmask per key, per key type.
+
+    file_keys: list of typed_keys() dicts, one per filter file (by position).
+    Each file is reduced to its distinct keys first, so the merge only sees
+    those, not every row. Returns {key type: (Index of unique keys, uint64
+    array [n_keys, n_words])} where bit i of the mask means "listed in
+    file i"; 64 files per word.
+    """
+    n_words = max(1, (len(file_keys) + 63) // 64)
+    blocklists = {}
+    for key_type in KEY_TYPES:
+        parts = [(i, pd.Series(keys[key_type].unique())) for i, keys in enumerate(file_keys) if key_type in keys]
+        if not parts:
+            continue
+        codes, uniques = pd.factorize(pd.concat([part for _, part in parts], ignore_index=True))
+        masks = np.zeros((len(uniques), n_words), dtype=np.uint64)
+        start = 0
+        for i, part in parts:
+            masks[codes[start:start + len(part)], i // 64] |= np.uint64(1) << np.uint64(i % 64)
+            start += len(part)
+        blocklists[key_type] = (pd.Index(uniques), masks)
+    return blocklists, n_words
+
+def match_blocklist(main_keys, n_rows, blocklists, n_words):
+    """One hash lookup per main key; returns per-row source bitmasks (0 = keep)."""
+    row_masks = np.zeros((n_rows, n_words), dtype=np.uint64)
+    for key_type, keys in main_keys.items():
+        if key_type not in blocklists:
+            continue
+        blocklist, masks = blocklists[key_type]
+        positions = blocklist.get_indexer(keys)
+        hit = positions >= 0
+        rows = keys.index.to_numpy()[hit]
+        for w in range(n_words):
+            # A row can hit through several key types: OR their masks together
+            np.bitwise_or.at(row_masks[:, w], rows, masks[positions[hit], w])
+    return row_masks
+
+def source_labels(row_masks, file_names):
+    """'file_a.xlsx; file_b.csv' per row, computed once per distinct mask."""
+    uniq, inverse = np.unique(row_masks, axis=0, return_inverse=True)
+    labels = np.array([
+        "; ".join(name for i, name in enumerate(file_names) if (m[i // 64] >> np.uint64(i % 64)) & np.uint64(1))
+        for m in uniq
+    ], dtype=object)
+    return labels[inverse.ravel()]
+
+def attribution_summary(row_masks, file_names, file_keys):
+    """Per filter file: blocklist size, rows it removed, and rows only it removed."""
+    bits = np.zeros((len(row_masks), len(file_names)), dtype=bool)
+    for i in range(len(file_names)):
+        bits[:, i] = (row_masks[:, i // 64] >> np.uint64(i % 64)) & np.uint64(1)
+    only_one = bits.sum(axis=1) == 1
+    return pd.DataFrame({
+        "Filter File": file_names,
+        "Blocklist Entries": [sum(len(k) for k in keys.values()) for keys in file_keys],
+        "Rows Removed": bits.sum(axis=0),
+        "Removed Only By This File": (bits & only_one[:, None]).sum(axis=0),
+    })
+
 # --- Helper: Load File ---
-def load_file(uploaded_file):
+def load_file(uploaded_file, nrows=None):
+    """nrows=0 reads just the headers (enough for the mapping UI on every rerun).
+
+    Everything is read as text: a blank cell would otherwise make a numeric
+    key column float, and ID 103 would become '103.0' and never match.
+    """
     try:
+        uploaded_file.seek(0)
         if uploaded_file.name.endswith('.csv'):
             # خواندن چند خط اول برای تشخیص جداکننده
             content = uploaded_file.read(2048).decode('utf-8')
             uploaded_file.seek(0)
             
             dialect = csv.Sniffer().sniff(content)
-            return pd.read_csv(uploaded_file, sep=dialect.delimiter)
+            return pd.read_csv(uploaded_file, sep=dialect.delimiter, dtype=str, nrows=nrows)
         else:
-            return pd.read_excel(uploaded_file)
+            return pd.read_excel(uploaded_file, dtype=str, nrows=nrows)
     except Exception as e:
         # در صورت شکست Sniffer، به حالت پیش‌فرض ویرگول برمی‌گردیم
         try:
             uploaded_file.seek(0)
-            return pd.read_csv(uploaded_file, sep=',')
+            return pd.read_csv(uploaded_file, sep=',', dtype=str, nrows=nrows)
         except:
             st.error(f"Error loading {uploaded_file.name}: {e}")
             return None
 # --- Main App Layout ---
 
 st.set_page_config(page_title="Multi-File Smart Cleaner", layout="wide")
+artifact_store.install()  # spill uploads/downloads to disk
 
 st.title("🇮🇷 Multi-File Smart Phone Filter")
 st.markdown("""
@@ -68,78 +196,111 @@ with col2:
 # --- Processing Logic ---
 if main_file and filter_files:
     
-    # 1. Load Main File
-    df_main = load_file(main_file)
+    # 1. Main File headers (the full files are only read on Run)
+    main_head = load_file(main_file, nrows=0)
     
-    # 2. Load First Filter File (to get column names)
-    # We read the first file just to populate the Dropdown menu
-    first_filter_df = load_file(filter_files[0])
+    # 2. Filter File headers (each can have its own). Same-named uploads get
+    # a numbered label; widget keys use the upload's id.
+    filter_heads = []  # (label, file, columns)
+    name_counts = {}
+    for f in filter_files:
+        head = load_file(f, nrows=0)
+        if head is None:
+            continue
+        name_counts[f.name] = name_counts.get(f.name, 0) + 1
+        label = f.name if name_counts[f.name] == 1 else f"{f.name} ({name_counts[f.name]})"
+        filter_heads.append((label, f, head.columns))
 
-    if df_main is not None and first_filter_df is not None:
+    if main_head is not None and filter_heads:
         st.markdown("---")
         st.subheader("3. Column Mapping")
+        st.caption("Map any of the key types. A row is removed if **any** of its keys is in a filter file.")
         
-        c1, c2, c3 = st.columns([1, 1, 1])
+        c1, c2 = st.columns([2, 1])
         
         with c1:
-            main_col = st.selectbox("Select ID Column in Main File:", df_main.columns)
-            
-        with c2:
-            # We assume all filter files have the same column name for the phone number
-            filter_col = st.selectbox("Select ID Column in Filter Files:", first_filter_df.columns,
-                                      help="Ensure all your filter files have this column header!")
+            st.markdown("##### Main File")
+            main_mapping = {}
+            defaults = {k: guess_column(main_head.columns, k) for k in KEY_TYPES}
+            if not any(defaults.values()):
+                defaults["phone"] = 1  # nothing recognized: first column as phone, like before
+            key_cols = st.columns(len(KEY_TYPES))
+            for col, (key_type, info) in zip(key_cols, KEY_TYPES.items()):
+                with col:
+                    choice = st.selectbox(info["label"], [NO_COLUMN] + list(main_head.columns),
+                                          index=defaults[key_type], key=f"main_{key_type}")
+                    main_mapping[key_type] = None if choice == NO_COLUMN else choice
         
-        with c3:
+        with c2:
             st.write("") # Spacer
             st.write("") # Spacer
             use_smart = st.checkbox("✅ Smart Matching", value=True, 
-                                    help="Ignores +98, 0, spaces, etc.")
+                                    help="Phone numbers: ignores +98, 0, spaces, etc.")
+
+        st.markdown("##### Filter Files")
+        filter_mappings = {}
+        for name, f, columns in filter_heads:
+            with st.expander(f"🗂️ {name}"):
+                mapping = {}
+                key_cols = st.columns(len(KEY_TYPES))
+                for col, (key_type, info) in zip(key_cols, KEY_TYPES.items()):
+                    with col:
+                        choice = st.selectbox(info["label"], [NO_COLUMN] + list(columns),
+                                              index=guess_column(columns, key_type, main_mapping[key_type]),
+                                              key=f"{f.file_id}_{key_type}")
+                        mapping[key_type] = None if choice == NO_COLUMN else choice
+                filter_mappings[name] = mapping
 
         st.markdown("---")
 
-        if st.button("🚀 Run Multi-File Cleaning", type="primary"):
+        if not any(main_mapping.values()):
+            st.warning("⚠️ Select at least one key column in the Main File.")
+
+        elif st.button("🚀 Run Multi-File Cleaning", type="primary"):
             
             # --- Step A: Build the Master Blocklist ---
-            master_blocklist = set()
+            file_names = []
+            file_keys = []
             
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Loop through all uploaded filter files
-            for i, f_file in enumerate(filter_files):
-                status_text.text(f"Processing filter file: {f_file.name}...")
-                
-                df_temp = load_file(f_file)
+            # Wait for a free CPU slot on the server, then build & match here
+            with get_pool().slot(session_id(), "cpu", on_wait=lambda s: status_text.text(describe(s))):
+                # Loop through all uploaded filter files
+                for i, (name, f, _) in enumerate(filter_heads):
+                    status_text.text(f"Processing filter file: {name}...")
                 
-                if df_temp is not None:
-                    # Check if the selected column exists in this file
-                    if filter_col in df_temp.columns:
-                        # Extract numbers
-                        raw_numbers = df_temp[filter_col].dropna().astype(str)
-                        
-                        if use_smart:
-                            # Apply standardization to this file's numbers
-                            clean_nums = raw_numbers.apply(standardize_iranian_number)
-                            master_blocklist.update(clean_nums)
-                        else:
-                            master_blocklist.update(raw_numbers.str.strip())
-                    else:
-                        st.warning(f"⚠️ Column '{filter_col}' not found in {f_file.name}. Skipping this file.")
+                    # Only key types mapped on both sides can ever match
+                    mapping = {k: c for k, c in filter_mappings[name].items() if c and main_mapping[k]}
+                    if not mapping:
+                        st.warning(f"⚠️ No shared key columns mapped for {name}. Skipping this file.")
+                    elif (df_filter := load_file(f)) is not None:
+                        file_names.append(name)
+                        file_keys.append(typed_keys(df_filter, mapping, use_smart))
                 
-                # Update progress bar
-                progress_bar.progress((i + 1) / len(filter_files))
+                    # Update progress bar
+                    progress_bar.progress((i + 1) / len(filter_heads))
 
-            status_text.text("Applying filter to Main File...")
+                status_text.text("Applying filter to Main File...")
             
-            # --- Step B: Clean the Main File ---
-            if use_smart:
-                main_vals_normalized = df_main[main_col].apply(standardize_iranian_number)
-                mask = ~main_vals_normalized.isin(master_blocklist)
-            else:
-                mask = ~df_main[main_col].astype(str).str.strip().isin(master_blocklist)
+                # --- Step B: Clean the Main File ---
+                df_main = load_file(main_file)
+                if df_main is None:
+                    st.stop()
+                # One hash lookup over every key type at once; the same pass
+                # yields which files each removed row came from.
+                blocklists, n_words = build_blocklist(file_keys)
+                main_keys = typed_keys(df_main.reset_index(drop=True), main_mapping, use_smart)
+                row_masks = match_blocklist(main_keys, len(df_main), blocklists, n_words)
+                mask = ~row_masks.any(axis=1)
             
-            df_cleaned = df_main[mask]
+                df_cleaned = df_main[mask]
+                df_removed = df_main[~mask].copy()
+                df_removed["removed_by"] = source_labels(row_masks[~mask], file_names)
+                summary_df = attribution_summary(row_masks, file_names, file_keys)
             
+
             # Stats
             original_count = len(df_main)
             removed_count = original_count - len(df_cleaned)
@@ -158,6 +319,11 @@ if main_file and filter_files:
             
             with st.expander("See Cleaned Data Preview"):
                 st.dataframe(df_cleaned.head(20))
+
+            st.write("### 🧾 Removed By Filter File")
+            st.dataframe(summary_df, use_container_width=True, hide_index=True)
+            with st.expander("See Removed Rows Preview"):
+                st.dataframe(df_removed.head(20))
             
             # --- Download ---
             buffer = io.BytesIO()
@@ -171,5 +337,17 @@ if main_file and filter_files:
                 mime="application/vnd.ms-excel"
             )
 
+            removed_buffer = io.BytesIO()
+            with pd.ExcelWriter(removed_buffer, engine='xlsxwriter') as writer:
+                df_removed.to_excel(writer, index=False, sheet_name="Removed")
+                summary_df.to_excel(writer, index=False, sheet_name="Summary")
+
+            st.download_button(
+                label="🧾 Download Removal Report (Excel)",
+                data=removed_buffer,
+                file_name="removed_rows_report.xlsx",
+                mime="application/vnd.ms-excel"
+            )
+
 elif not main_file or not filter_files:
     st.info("👋 Please upload your files to begin.")
\ No newline at end of file
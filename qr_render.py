@@ -0,0 +1,389 @@
+"""QR rendering helpers shared by the QR page and its worker processes.
+
+Kept outside ``pages/`` so ProcessPoolExecutor workers can import them
+(functions defined inside a Streamlit page script can't be pickled).
+"""
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from worker_pool import get_pool
+
+BATCH_SIZE = 200  # links per worker task
+MIN_MODULES = 21  # side of the smallest (version 1) QR code, in modules
+
+def build_qr(link, box, border, error_correction=qrcode.constants.ERROR_CORRECT_L):
+    """Builds the QRCode object shared by the raster and vector renderers."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box,
+        border=border,
+    )
+    qr.add_data(link)
+    qr.make(fit=True)
+    return qr
+
+def hex_to_rgb(hex_color):
+    """'#1a2b3c' -> (26, 43, 60)"""
+    return tuple(int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+
+def generate_qr(link, fill_hex, back_hex_or_none, box, border, error_correction=qrcode.constants.ERROR_CORRECT_L):
+    """Generates a PIL Image of the QR code."""
+    qr = build_qr(link, box, border, error_correction)
+
+    img = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
+    
+    datas = img.getdata()
+    new_data = []
+    
+    # Convert hex to RGB tuple
+    fill_rgb = hex_to_rgb(fill_hex)
+    
+    if back_hex_or_none:
+        back_rgb = hex_to_rgb(back_hex_or_none)
+    else:
+        back_rgb = (0, 0, 0, 0)
+
+    for item in datas:
+        if item[0] == 0: 
+            new_data.append(fill_rgb + (255,)) 
+        else:
+            if back_hex_or_none:
+                new_data.append(back_rgb + (255,))
+            else:
+                new_data.append((255, 255, 255, 0)) 
+
+    img.putdata(new_data)
+    return img
+
+def module_runs(matrix):
+    """Yields (x, y, length) for every horizontal run of dark modules.
+
+    Merging runs keeps vector output proportional to the module count
+    instead of emitting one shape per dark module.
+    """
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                yield start, y, x - start
+            else:
+                x += 1
+
+def generate_qr_svg(link, fill_hex, back_hex_or_none, box, border):
+    """Generates the QR code as SVG bytes (one path, one unit per module)."""
+    matrix = build_qr(link, box, border).get_matrix()  # includes the quiet zone
+    n = len(matrix)
+    path = "".join(f"M{x} {y}h{w}v1h-{w}z" for x, y, w in module_runs(matrix))
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{n * box}" height="{n * box}" '
+        f'viewBox="0 0 {n} {n}" shape-rendering="crispEdges">'
+    ]
+    if back_hex_or_none:
+        parts.append(f'<rect width="{n}" height="{n}" fill="{back_hex_or_none}"/>')
+    parts.append(f'<path d="{path}" fill="{fill_hex}"/>')
+    parts.append('</svg>')
+    return "".join(parts).encode("utf-8")
+
+def generate_qr_pdf(links, fill_hex, back_hex_or_none, box, border):
+    """Generates a vector PDF with one QR code per page (1 box pixel = 1pt)."""
+    fill_rgb = " ".join(f"{c / 255:.4f}" for c in hex_to_rgb(fill_hex))
+    back_rgb = " ".join(f"{c / 255:.4f}" for c in hex_to_rgb(back_hex_or_none)) if back_hex_or_none else None
+
+    objects = []  # index i -> object number i + 3 (1 = Catalog, 2 = Pages)
+    page_refs = []
+    for link in links:
+        matrix = build_qr(link, box, border).get_matrix()
+        n = len(matrix)
+        side = n * box
+
+        # PDF origin is bottom-left, so flip y.
+        ops = []
+        if back_rgb:
+            ops.append(f"{back_rgb} rg 0 0 {side} {side} re f")
+        ops.append(f"{fill_rgb} rg")
+        for x, y, w in module_runs(matrix):
+            ops.append(f"{x * box} {(n - y - 1) * box} {w * box} {box} re")
+        ops.append("f")
+        stream = "\n".join(ops).encode("ascii")
+
+        content_num = len(objects) + 4
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {side} {side}] /Contents {content_num} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_refs.append(f"{content_num - 1} 0 R")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode("ascii"),
+    ] + objects
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+    xref_pos = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_pos))
+    return out.getvalue()
+
+def get_slug(url):
+    """Extracts a clean filename from the URL."""
+    try:
+        parsed = urlparse(url)
+        slug = parsed.path.rsplit("/", 1)[-1]
+        if not slug:
+            return "qr_code"
+        return slug
+    except:
+        return "qr_code"
+
+FORMAT_EXT = {"PNG": "png", "SVG": "svg", "PDF": "pdf"}
+FORMAT_MIME = {"PNG": "image/png", "SVG": "image/svg+xml", "PDF": "application/pdf"}
+
+def normalize_link(raw_link):
+    """Strips the cell and adds https:// when no scheme is given. Returns None for empty cells."""
+    link = str(raw_link).strip()
+    if not link:
+        return None
+    if not link.startswith(("http://", "https://")):
+        link = "https://" + link
+    return link
+
+class QRTemplate:
+    """Branding layout (logo + caption on a fixed canvas) for PNG output.
+
+    Everything that is the same for every code — the decoded and resized
+    logo on its backing plate, the font, the layout — is built once in
+    __init__, so per code we only paste the QR, the logo layer and the
+    caption. The blank canvas is a solid fill, so apply() makes it per code
+    instead of keeping (and pickling) a full-size copy. Instances pickle
+    (the font is reloaded lazily in workers); `key` identifies the inputs
+    for the render cache.
+    """
+
+    def __init__(self, canvas_w, canvas_h, back_hex_or_none, logo_bytes=None, logo_ratio=0.22,
+                 caption_pos="below", font_bytes=None, font_size=28, text_hex="#000000"):
+        self.key = (canvas_w, canvas_h, back_hex_or_none, hashlib.sha1(logo_bytes or b"").hexdigest(),
+                    logo_ratio, caption_pos, hashlib.sha1(font_bytes or b"").hexdigest(), font_size, text_hex)
+        self.canvas_w, self.canvas_h = canvas_w, canvas_h
+        self.caption_pos = caption_pos
+        self.font_bytes, self.font_size = font_bytes, font_size
+        self.text_rgb = hex_to_rgb(text_hex)
+        # A logo hides modules, so switch to the highest error correction
+        self.error_correction = qrcode.constants.ERROR_CORRECT_H if logo_bytes else qrcode.constants.ERROR_CORRECT_L
+
+        # 1. QR area: the canvas minus the caption band
+        band = int(font_size * 1.8) if caption_pos != "none" else 0
+        self.qr_side = min(canvas_w, canvas_h - band)
+        if self.qr_side < MIN_MODULES:
+            raise ValueError(f"The caption leaves {max(self.qr_side, 0)}px for the QR code, it needs at least "
+                             f"{MIN_MODULES}px. Make the canvas taller or the caption font smaller.")
+        qr_top = band if caption_pos == "above" else 0
+        self.qr_box = ((canvas_w - self.qr_side) // 2, qr_top)
+        self.caption_center = (canvas_w // 2, self.qr_side + band // 2 if caption_pos == "below" else band // 2)
+
+        # 2. Canvas fill
+        self.back = hex_to_rgb(back_hex_or_none) + (255,) if back_hex_or_none else (255, 255, 255, 0)
+
+        # 3. Logo, decoded and scaled once, on a plate so it stays readable over the modules
+        self.logo = None
+        if logo_bytes:
+            side = max(1, int(self.qr_side * logo_ratio))
+            with Image.open(io.BytesIO(logo_bytes)) as logo:
+                logo = ImageOps.contain(logo.convert("RGBA"), (side, side), Image.LANCZOS)
+            pad = max(2, side // 10)
+            plate_rgb = hex_to_rgb(back_hex_or_none) if back_hex_or_none else (255, 255, 255)
+            plate = Image.new("RGBA", (logo.width + 2 * pad, logo.height + 2 * pad), (0, 0, 0, 0))
+            ImageDraw.Draw(plate).rounded_rectangle((0, 0, plate.width - 1, plate.height - 1), radius=pad, fill=plate_rgb + (255,))
+            plate.alpha_composite(logo, (pad, pad))
+            self.logo = plate
+
+        self._font = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_font"] = None  # FreeType fonts built from bytes don't pickle
+        return state
+
+    @property
+    def font(self):
+        if self._font is None:
+            if self.font_bytes:
+                self._font = ImageFont.truetype(io.BytesIO(self.font_bytes), self.font_size)
+            else:
+                self._font = ImageFont.load_default(size=self.font_size)
+        return self._font
+
+    def apply(self, link, fill_hex, back_hex_or_none, border):
+        """Composes the branded image for one link."""
+        # Render at 1px per module and upscale by an integer factor: same
+        # pixels as rendering at that box size, without the per-pixel cost.
+        qr_img = generate_qr(link, fill_hex, back_hex_or_none, 1, border, self.error_correction)
+        if qr_img.width > self.qr_side:
+            raise ValueError(f"'{unquote(get_slug(link))}' needs {qr_img.width}px for its QR code, the template only has {self.qr_side}px. "
+                             "Make the canvas bigger, the caption font or the border smaller.")
+        box = self.qr_side // qr_img.width
+        qr_img = qr_img.resize((qr_img.width * box, qr_img.height * box), Image.NEAREST)
+
+        canvas = Image.new("RGBA", (self.canvas_w, self.canvas_h), self.back)
+        x = self.qr_box[0] + (self.qr_side - qr_img.width) // 2
+        y = self.qr_box[1] + (self.qr_side - qr_img.height) // 2
+        canvas.alpha_composite(qr_img, (x, y))
+
+        if self.logo is not None:
+            canvas.alpha_composite(self.logo, (x + (qr_img.width - self.logo.width) // 2,
+                                               y + (qr_img.height - self.logo.height) // 2))
+
+        if self.caption_pos != "none":
+            ImageDraw.Draw(canvas).text(self.caption_center, unquote(get_slug(link)), font=self.font,
+                                        fill=self.text_rgb + (255,), anchor="mm")
+        return canvas
+
+def render_bytes(link, fmt, fill_hex, back_hex_or_none, box, border, template=None):
+    """Renders one link to PNG or SVG bytes. The template only applies to PNG."""
+    if fmt == "SVG":
+        return generate_qr_svg(link, fill_hex, back_hex_or_none, box, border)
+    if template is not None:
+        img = template.apply(link, fill_hex, back_hex_or_none, border)
+    else:
+        img = generate_qr(link, fill_hex, back_hex_or_none, box, border)
+    img_byte_arr = io.BytesIO()
+    img.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def render_batch(links, fmt, fill_hex, back_hex_or_none, box, border, template=None):
+    """Worker task: renders a batch of links, in order."""
+    return [render_bytes(link, fmt, fill_hex, back_hex_or_none, box, border, template) for link in links]
+
+class RenderCache:
+    """Memory-bounded LRU of rendered QR bytes, keyed by link + style.
+
+    One instance lives for the whole server process (the module is only
+    imported once), so Streamlit reruns and repeated links reuse renders.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+render_cache = RenderCache()
+
+def cache_key(link, fmt, fill_hex, back_hex_or_none, box, border, template=None):
+    """Render cache key. Holds the template's inputs, not the template, so
+    cached entries don't keep its logo layer alive."""
+    return (link, fmt, fill_hex, back_hex_or_none, box, border, template.key if template is not None else None)
+
+def cached_render(link, fmt, fill_hex, back_hex_or_none, box, border, template=None):
+    """render_bytes() through the shared render cache."""
+    key = cache_key(link, fmt, fill_hex, back_hex_or_none, box, border, template)
+    data = render_cache.get(key)
+    if data is None:
+        data = render_bytes(link, fmt, fill_hex, back_hex_or_none, box, border, template)
+        render_cache.put(key, data)
+    return data
+
+def _iter_batches(links, style, session, on_wait):
+    """Yields rendered bytes per batch of BATCH_SIZE links, in input order.
+
+    A single batch renders in this thread (holding a CPU slot); bigger jobs
+    are queued on the shared worker pool and streamed back in order.
+    """
+    batches = [links[i:i + BATCH_SIZE] for i in range(0, len(links), BATCH_SIZE)]
+    pool = get_pool()
+
+    if len(batches) < 2:
+        for batch in batches:
+            with pool.slot(session, "cpu", on_wait):
+                rendered = render_batch(batch, *style)
+            yield rendered
+        return
+
+    n = len(batches)
+    yield from pool.map(session, "cpu", render_batch, batches, *([value] * n for value in style), on_wait=on_wait)
+
+def iter_rendered(links, fmt, fill_hex, back_hex_or_none, box, border, template=None, session="local", on_wait=None):
+    """Yields one list of rendered bytes per batch of BATCH_SIZE links, in input order.
+
+    Each distinct link that isn't already cached is rendered once; repeats
+    are served from the render cache. on_wait(status) is called while the
+    job waits for the worker pool.
+    """
+    style = (fmt, fill_hex, back_hex_or_none, box, border, template)
+
+    # Distinct, uncached links in first-occurrence order
+    todo = list(dict.fromkeys(link for link in links if cache_key(link, *style) not in render_cache))
+    pending = set(todo)
+    fresh = (data for batch in _iter_batches(todo, style, session, on_wait) for data in batch)
+
+    for start in range(0, len(links), BATCH_SIZE):
+        out = []
+        for link in links[start:start + BATCH_SIZE]:
+            key = cache_key(link, *style)
+            if link in pending:
+                # First occurrence: its render is the next one in the stream
+                pending.discard(link)
+                data = next(fresh)
+                render_cache.misses += 1
+                render_cache.put(key, data)
+            else:
+                data = cached_render(link, *style)  # falls back to inline if evicted
+            out.append(data)
+        yield out
+
+def unique_filename(link, i, ext, used_names):
+    """'<slug>.<ext>', or '<slug>_<i>.<ext>' if that name is already in the archive."""
+    filename = f"{get_slug(link)}.{ext}"
+    if filename in used_names:
+        filename = f"{get_slug(link)}_{i}.{ext}"
+    used_names.add(filename)
+    return filename
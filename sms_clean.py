@@ -0,0 +1,73 @@
+"""Number cleaning for the SMS page and its worker processes.
+
+Kept outside ``pages/`` so ProcessPoolExecutor workers can import it
+(functions defined inside a Streamlit page script can't be pickled).
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from worker_pool import get_pool
+
+CHUNK_SIZE = 50_000  # rows per normalize task
+DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹' + '٠١٢٣٤٥٦٧٨٩', '0123456789' * 2)
+
+def normalize_number(number, convert_digits, remove_nondigits, fix_prefix):
+    """Applies the formatting rules to one number; None if it's empty."""
+    if pd.isna(number) or str(number).strip() == "":
+        return None
+
+    number = str(number).strip()
+
+    # 1. Translation (Farsi/Arabic -> English)
+    if convert_digits:
+        number = number.translate(DIGITS)
+
+    # 2. Handle Prefixes (do +98 / 0098 BEFORE stripping non-digits)
+    if fix_prefix:
+        if number.startswith('+98'):
+            number = '0' + number[3:]
+        elif number.startswith('0098'):
+            number = '0' + number[4:]
+
+    # 3. Remove Non-Digits
+    if remove_nondigits:
+        number = re.sub(r'\D', '', number)
+
+    # 4. Handle Prefixes (after stripping non-digits)
+    if fix_prefix:
+        if number.startswith('98') and len(number) > 10:
+            number = '0' + number[2:]
+        elif number.startswith('9') and len(number) == 10:
+            number = '0' + number
+
+    return number
+
+def normalize_chunk(values, options):
+    return [normalize_number(v, *options) for v in values]
+
+def filter_numbers(normalized, filter_length, filter_mobile):
+    """The validation checks, vectorized: numbers that fail become None."""
+    ok = normalized.notna()
+    if filter_length:
+        ok &= normalized.str.len().eq(11)
+    if filter_mobile:
+        ok &= normalized.str.startswith("09", na=False)
+    return normalized.where(ok, None)
+
+def dedup_positions(cleaned):
+    """Row positions to keep: valid numbers, first occurrence of each."""
+    valid = np.flatnonzero(cleaned.notna().to_numpy())
+    return valid[~cleaned.iloc[valid].duplicated().to_numpy()]
+
+def parallel_normalize(values, options, session="local", on_wait=None):
+    """normalize_number over a column, fanned out in row chunks on the shared worker pool."""
+    values = np.asarray(values, dtype=object)
+    chunks = [values[i:i + CHUNK_SIZE] for i in range(0, len(values), CHUNK_SIZE)]
+    normalized = np.empty(len(values), dtype=object)
+    start = 0
+    for part in get_pool().map(session, "cpu", normalize_chunk, chunks, [options] * len(chunks), on_wait=on_wait):
+        normalized[start:start + len(part)] = part
+        start += len(part)
+    return normalized
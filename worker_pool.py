@@ -0,0 +1,274 @@
+"""Server-wide worker pool that every page submits its heavy work to.
+
+One pool per server process (module state is shared by all sessions and
+survives reruns), with two lanes:
+
+- "cpu": rendering, cleaning, matching. WORKER_CPU_SLOTS tasks at a time
+  (default: the cores this container may use). Tasks run in one persistent spawn process
+  pool. slot() instead holds a CPU slot while code runs in the caller's
+  thread.
+- "io": downloads. WORKER_IO_SLOTS tasks at a time, on threads.
+
+Within a lane, sessions take turns, one task each, so a 5000-row job can't
+starve a 10-row job that arrives after it. status() gives a session's
+place in line and an ETA from the lane's recent task times (kept apart
+for pool tasks and slot() holds, which take very different times).
+
+Note: with spawn, Streamlit's __main__ is the page script, so each worker
+process runs it once (in bare mode, which does nothing) when it starts.
+The pool is persistent, so this happens once per worker, not per job.
+"""
+import concurrent.futures
+import contextlib
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+def available_cpus():
+    """Cores this process may actually use: its affinity mask, capped by a cgroup CPU quota.
+
+    os.cpu_count() is the host's count, so in a container limited with
+    --cpus it would start far too many workers.
+    """
+    n = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    for quota_path, period_path in (("/sys/fs/cgroup/cpu.max", None),  # cgroup v2: "<quota> <period>"
+                                    ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+        try:
+            with open(quota_path) as f:
+                quota, *period = f.read().split()
+            if period_path:
+                with open(period_path) as f:
+                    period = f.read().split()
+            if quota not in ("max", "-1"):
+                n = min(n, max(1, int(quota) // int(period[0])))
+            break
+        except (OSError, ValueError, IndexError):
+            continue
+    return n
+
+CPU_SLOTS = int(os.environ.get("WORKER_CPU_SLOTS", available_cpus()))
+IO_SLOTS = int(os.environ.get("WORKER_IO_SLOTS", "24"))
+POLL_SECONDS = 1.0  # how often waiting pages refresh their queue status
+
+def session_id():
+    """The current Streamlit session, or 'local' outside a script run."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else "local"
+
+def _hold(granted, released):
+    granted.set()
+    released.wait()
+
+class _Lane:
+    """Fixed number of worker threads serving per-session queues round-robin."""
+
+    def __init__(self, name, slots, runner):
+        self.name = name
+        self.slots = slots
+        self.avg_seconds = {}  # inline (slot hold) or not -> moving average of task time, for ETAs
+        self.completed = 0
+        self._runner = runner
+        self._queues = OrderedDict()  # session -> deque of tasks; order = whose turn is next
+        self._running = defaultdict(int)
+        self._running_inline = defaultdict(int)  # inline -> tasks running now
+        self._caps = {}
+        self._cond = threading.Condition()
+        for i in range(slots):
+            threading.Thread(target=self._work, name=f"pool-{name}-{i}", daemon=True).start()
+
+    def submit(self, session, fn, args, cap=None, inline=False):
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._queues.setdefault(session, deque()).append((future, fn, args, inline))
+            if cap:
+                self._caps[session] = cap
+            self._cond.notify()
+        return future
+
+    def _take(self):
+        """Next task by turn, skipping sessions at their cap. Lock must be held."""
+        for session, queue in self._queues.items():
+            if self._running[session] < self._caps.get(session, self.slots):
+                task = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(session)  # back of the line
+                else:
+                    del self._queues[session]
+                self._running[session] += 1
+                self._running_inline[task[3]] += 1
+                return session, task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while (picked := self._take()) is None:
+                    self._cond.wait()
+            session, (future, fn, args, inline) = picked
+            start = time.perf_counter()
+            ran = future.set_running_or_notify_cancel()
+            if ran:
+                try:
+                    future.set_result(fn(*args) if inline else self._runner(fn, args))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._cond:
+                self._running[session] -= 1
+                self._running_inline[inline] -= 1
+                if not self._running[session]:
+                    del self._running[session]
+                    if session not in self._queues:
+                        self._caps.pop(session, None)
+                if ran:
+                    seconds = time.perf_counter() - start
+                    avg = self.avg_seconds.get(inline)
+                    self.avg_seconds[inline] = seconds if avg is None else 0.8 * avg + 0.2 * seconds
+                    self.completed += 1
+                self._cond.notify_all()  # a capped session may be allowed again
+
+    def cancel(self, session, futures=None):
+        """Drops a session's queued (not yet running) tasks, or just those among `futures`."""
+        with self._cond:
+            queue = self._queues.get(session)
+            if not queue:
+                return
+            drop = None if futures is None else {id(f) for f in futures}
+            kept = deque()
+            for task in queue:
+                if drop is None or id(task[0]) in drop:
+                    task[0].cancel()
+                else:
+                    kept.append(task)
+            if kept:
+                self._queues[session] = kept
+            else:
+                del self._queues[session]
+
+    def _seconds(self, inline):
+        """Expected time of a task of this kind (the other kind's average until one has run)."""
+        return self.avg_seconds.get(inline, self.avg_seconds.get(not inline))
+
+    def status(self, session):
+        with self._cond:
+            queued = len(self._queues.get(session, ()))
+            running = self._running.get(session, 0)
+            order = list(self._queues)
+            ahead = order.index(session) if session in self._queues else 0
+            eta = None
+            if self.avg_seconds and (queued or running):
+                # Taking turns, every other session gets about as many tasks in as we have left
+                work = sum(self._seconds(task[3]) for s, q in self._queues.items()
+                           for task in itertools.islice(q, None if s == session else queued))
+                work += sum(n * self._seconds(inline) for inline, n in self._running_inline.items())
+                eta = work / self.slots
+        return {"queued": queued, "running": running, "ahead": ahead, "eta": eta}
+
+    def stats(self):
+        with self._cond:
+            return {
+                "running": sum(self._running.values()),
+                "queued": sum(len(q) for q in self._queues.values()),
+                "sessions": len(set(self._queues) | set(self._running)),
+            }
+
+class WorkerPool:
+    def __init__(self, cpu_slots=CPU_SLOTS, io_slots=IO_SLOTS):
+        self._processes = None
+        self._processes_lock = threading.Lock()
+        self.lanes = {
+            "cpu": _Lane("cpu", cpu_slots, self._run_in_process),
+            "io": _Lane("io", io_slots, lambda fn, args: fn(*args)),
+        }
+
+    def _run_in_process(self, fn, args):
+        with self._processes_lock:
+            if self._processes is None:
+                # spawn, not fork: the Streamlit server is multi-threaded
+                ctx = multiprocessing.get_context("spawn")
+                self._processes = concurrent.futures.ProcessPoolExecutor(max_workers=self.lanes["cpu"].slots, mp_context=ctx)
+            processes = self._processes
+        try:
+            return processes.submit(fn, *args).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (e.g. OOM-killed): start a fresh pool for the next task
+            with self._processes_lock:
+                if self._processes is processes:
+                    self._processes = None
+            raise
+
+    def submit(self, session, lane, fn, *args, cap=None):
+        """Queues fn(*args); returns a Future. cap limits how many of this session's tasks run at once."""
+        return self.lanes[lane].submit(session, fn, args, cap=cap)
+
+    def map(self, session, lane, fn, *iterables, on_wait=None):
+        """Like executor.map, in order. Unstarted tasks are cancelled if the caller stops early."""
+        futures = [self.submit(session, lane, fn, *args) for args in zip(*iterables)]
+        try:
+            for future in futures:
+                while on_wait is not None and not future.done():
+                    on_wait(self.status(session, lane))
+                    concurrent.futures.wait([future], timeout=POLL_SECONDS)
+                yield future.result()
+        finally:
+            self.lanes[lane].cancel(session, futures)
+
+    def as_completed(self, session, lane, futures, on_wait=None):
+        """Yields futures as they finish; calls on_wait(status) while nothing does."""
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=POLL_SECONDS,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done and on_wait is not None:
+                    on_wait(self.status(session, lane))
+                yield from done
+        finally:
+            self.lanes[lane].cancel(session, pending)
+
+    @contextlib.contextmanager
+    def slot(self, session, lane="cpu", on_wait=None):
+        """Waits for this session's turn, then holds one lane slot while the with-block runs here."""
+        granted, released = threading.Event(), threading.Event()
+        future = self.lanes[lane].submit(session, _hold, (granted, released), inline=True)
+        try:
+            while not granted.wait(POLL_SECONDS):
+                if on_wait is not None:
+                    on_wait(self.status(session, lane))
+            yield
+        finally:
+            released.set()
+            self.lanes[lane].cancel(session, [future])
+
+    def cancel(self, session):
+        for lane in self.lanes.values():
+            lane.cancel(session)
+
+    def status(self, session, lane):
+        return self.lanes[lane].status(session)
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The server's pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+def describe(status):
+    """One-line queue status for a page's status text."""
+    eta = f" · ETA ~{math.ceil(status['eta'])}s" if status["eta"] is not None else ""
+    if status["queued"] and not status["running"]:
+        ahead = status["ahead"]
+        return f"⏳ Waiting for a free worker ({ahead} session{'s' if ahead != 1 else ''} ahead of you){eta}"
+    return f"⚙️ {status['running']} running, {status['queued']} queued{eta}"
@@ -1,4 +1,6 @@
 import streamlit as st
+import artifact_store
+from worker_pool import get_pool
 
 # 1. Page Configuration
 st.set_page_config(
@@ -7,6 +9,7 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
+artifact_store.install()  # spill uploads/downloads to disk
 
 # 2. CSS Injection for Full RTL & Vazir Font
 st.markdown("""
@@ -95,4 +98,10 @@ with col3:
 
 # --- SYSTEM STATUS ---
 st.markdown("---")
-st.caption("🟢 وضعیت سیستم: آنلاین | 🏢 داشبورد اتوماسیون جانبی")
\ No newline at end of file
+pool_stats = get_pool().stats()
+st.caption(
+    f"🟢 وضعیت سیستم: آنلاین | 🏢 داشبورد اتوماسیون جانبی | "
+    f"💾 فایل‌های موقت: {len(artifact_store.artifacts)} فایل، {artifact_store.artifacts.size / 1024 / 1024:.0f} MB | "
+    f"⚙️ صف پردازش: {pool_stats['cpu']['running']} در حال اجرا، {pool_stats['cpu']['queued']} در صف | "
+    f"🌐 دانلودها: {pool_stats['io']['running']} در حال اجرا، {pool_stats['io']['queued']} در صف"
+)
\ No newline at end of file